@@ -83,6 +83,8 @@ h.dt = .115     # We choose dt = 0.1 here because the ratio of d * dt / dx**2 mu
 print(f"starting initialization at {time.perf_counter()}")
 h.finitialize(-65)
 print(f"finished initialization at {time.perf_counter()}")
+# look up the apic[1] nodes once instead of at every checkpoint
+apic1_nodes = ca.nodes(mycell.apic[1])
 
 rng = 190   # number of timesteps
 run = 3     # time-step length in ms
@@ -92,7 +94,7 @@ for i in range(rng):
     print(f"started {i} at: {start}")
     h.continuerun(i*run)
     plt.figure(2, figsize=(15,27.6))    # this choice of size is arbitrary
-    if max(ca.nodes(mycell.apic[1]).concentration) > 0.5:   # changed from 0.5 to 0 to finally get SOME results
+    if max(apic1_nodes.concentration) > 0.5:   # changed from 0.5 to 0 to finally get SOME results
         print("Plotting contours...")
         plt.figure(1)
         plot_contours(ca, i, perspective=perspective)   # get both perspectives
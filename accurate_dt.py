@@ -0,0 +1,103 @@
+"""Pick a fixed h.dt from the model instead of by hand.
+
+The scripts have been choosing dt from rules of thumb: Figure1A keeps
+d * dt / dx ** 2 below 1, comparison-to-truth.py halves NEURON's default for
+small dx. accurate_dt() applies the same kind of rule systematically:
+
+  diffusion:  D * dt / dx_eff ** 2 <= diffusion_number for every diffusing
+              species, where dx_eff = dx * f ** (1 / 3) shrinks dx for partial
+              voxels (f is a low quantile of volume / dx ** 3 over 3D nodes;
+              1D nodes use their segment length)
+  reactions:  dt * k <= reaction_number, with k an upper bound on
+              |d rate / d c|
+
+These are accuracy heuristics, not stability limits: rxd's fixed step solver
+is implicit (ADI in 3D), so it stays stable at any dt, but its error grows
+with how far diffusion and reactions move the concentrations in one step,
+which these numbers measure. They depend only on D, dx and the reaction
+rates, so models sharing those get the same dt; accurate_dt_benchmark.py
+measures the error at multiples of it against CVODE, which is the check that
+the default numbers are tight enough for a given model.
+
+Call it after the model is built and discretized (e.g. after h.finitialize).
+"""
+import numpy as np
+from neuron import h, rxd
+from neuron.rxd.node import Node3D
+
+
+def _diffusing_species():
+    result = []
+    for ref in rxd.species._all_species:
+        species = ref()
+        if species is not None and not isinstance(species, (rxd.State, rxd.Parameter)):
+            if species.d:
+                result.append(species)
+    return result
+
+
+def effective_dx(species, volume_fraction_quantile=0.01):
+    """smallest effective grid spacing (µm) seen by a species' nodes"""
+    dxs = []
+    fractions = []
+    for node in species.nodes:
+        if isinstance(node, Node3D):
+            dx = node.region.dx
+            dxs.append(dx)
+            fractions.append(node.volume / dx ** 3)
+        else:
+            dxs.append(node.sec.L / node.sec.nseg)
+    result = min(dxs)
+    if fractions:
+        # the smallest slivers would force an absurdly small dt; a low quantile
+        # keeps the criterion meaningful for the bulk of the boundary voxels
+        fraction = min(max(np.quantile(fractions, volume_fraction_quantile), 1e-3), 1)
+        result = min(result, min(dxs) * fraction ** (1 / 3))
+    return result
+
+
+def max_rate_derivative(rate, cmin, cmax, samples=1001):
+    """upper bound on |d rate / d c| (1/ms) for a Python function of one concentration
+
+    e.g. max_rate_derivative(lambda c: -c * (1 - c) * (0.25 - c), 0, 1)
+    """
+    cs = np.linspace(cmin, cmax, samples)
+    values = np.array([rate(c) for c in cs])
+    return float(np.max(np.abs(np.gradient(values, cs))))
+
+
+def diffusion_dt(diffusion_number=1.0, volume_fraction_quantile=0.01):
+    """largest dt (ms) meeting the diffusion criterion for every diffusing species"""
+    dts = [
+        diffusion_number * effective_dx(species, volume_fraction_quantile) ** 2 / species.d
+        for species in _diffusing_species()
+    ]
+    return min(dts) if dts else np.inf
+
+
+def reaction_dt(rate_derivative, reaction_number=1.0):
+    """largest dt (ms) for reactions whose rates change by at most rate_derivative per mM"""
+    return reaction_number / rate_derivative if rate_derivative else np.inf
+
+
+def accurate_dt(
+    rate_derivative=0,
+    diffusion_number=1.0,
+    reaction_number=1.0,
+    volume_fraction_quantile=0.01,
+    max_dt=None,
+):
+    """largest fixed dt (ms) satisfying both criteria, capped at max_dt if given
+
+    The result is rounded down to a value that divides 1 ms evenly so that
+    output at whole ms lands exactly on a step.
+    """
+    dt = min(
+        diffusion_dt(diffusion_number, volume_fraction_quantile),
+        reaction_dt(rate_derivative, reaction_number),
+        np.inf if max_dt is None else max_dt,
+    )
+    if np.isinf(dt):
+        # nothing diffuses or reacts; any step size is fine
+        return h.dt
+    return 1 / np.ceil(1 / dt)
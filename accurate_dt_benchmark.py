@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from neuron import h, rxd
+from neuron.units import mV, ms, µm, mM
+from accurate_dt import accurate_dt, max_rate_derivative
+
+h.load_file("stdrun.hoc")
+
+DB_FILENAME = "accurate_dt.db"
+REFERENCE_ATOL = 1e-10
+# the tight-tolerance CVODE reference is the slowest run; it is computed once
+# per (model, dx) and kept here
+REFERENCE_DIRECTORY = "accurate_dt_references"
+
+
+def diffusion(dx):
+    """pure 3D diffusion from a pulse in the middle of a cylinder (as 3d-convergence.py)"""
+    axon = h.Section(name="axon")
+    axon.pt3dadd(0, 0, 0, 2 * µm)
+    axon.pt3dadd(50 * µm, 0, 0, 2 * µm)
+    rxd.set_solve_type(dimension=3)
+    cyt = rxd.Region([axon], name="cyt", nrn_region="i", dx=dx)
+    ca = rxd.Species(cyt, name="ca", d=1, charge=2, initial=lambda node: 1 * mM if 20 < node.x3d < 30 else 0)
+    return {"name": "diffusion", "secs": [axon], "regions": [cyt], "species": [ca], "rate_derivative": 0, "tstop": 20 * ms}
+
+
+def bistable(dx, alpha=0.25):
+    """bistable wave on a 3D cylinder (as wave_time_3d.py)"""
+    dend = h.Section(name="dend")
+    dend.pt3dadd(0, 0, 0, 2 * µm)
+    dend.pt3dadd(100 * µm, 0, 0, 2 * µm)
+    dend.nseg = 101
+    rxd.set_solve_type(dimension=3)
+    cyt = rxd.Region([dend], name="cyt", nrn_region="i", dx=dx)
+    c = rxd.Species(cyt, d=1, name="c", initial=lambda node: 1 if node.x3d < 20 else 0)
+    reaction = rxd.Rate(c, -c * (1 - c) * (alpha - c))
+    return {
+        "name": "bistable",
+        "secs": [dend],
+        "regions": [cyt],
+        "species": [c],
+        "reactions": [reaction],
+        "rate_derivative": max_rate_derivative(lambda c: -c * (1 - c) * (alpha - c), 0, 1),
+        "tstop": 50 * ms,
+    }
+
+
+def hybrid(dx):
+    """diffusion across 1D/3D/1D sections (as axon2 in comparison-to-truth.py)"""
+    secs = [h.Section(name=f"axon{i}") for i in range(3)]
+    for sec in secs:
+        sec.L = 17 * µm
+        sec.diam = 2 * µm
+        sec.nseg = int(sec.L) * 2
+    secs[1].connect(secs[0])
+    secs[2].connect(secs[1])
+    rxd.set_solve_type([secs[1]], dimension=3)
+    cyt = rxd.Region(secs, name="cyt", nrn_region="i", dx=dx)
+    ca = rxd.Species(cyt, name="ca", d=1, charge=2, initial=lambda node: 1 * mM if 23 < node.x3d < 28 else 0)
+    return {"name": "hybrid", "secs": secs, "regions": [cyt], "species": [ca], "rate_derivative": 0, "tstop": 20 * ms}
+
+
+def run(model, method, dt=None, atol=None):
+    """run the model from initialization; return the final state, runtime and step count"""
+    h.CVode().active(method == "cvode")
+    if method == "cvode":
+        h.CVode().atol(atol)
+    else:
+        h.dt = dt
+    t = h.Vector().record(h._ref_t)
+    h.finitialize(-65 * mV)
+    start = time.perf_counter()
+    h.continuerun(model["tstop"])
+    runtime = time.perf_counter() - start
+    values = np.concatenate([np.array(species.nodes.value) for species in model["species"]])
+    return values, runtime, len(t) - 1
+
+
+def reference_values(model, dx):
+    """the CVODE solution at REFERENCE_ATOL, from REFERENCE_DIRECTORY if already computed"""
+    filename = os.path.join(REFERENCE_DIRECTORY, f"{model['name']}_dx{dx}_atol{REFERENCE_ATOL}.npy")
+    if os.path.exists(filename):
+        return np.load(filename)
+    values, runtime, _ = run(model, "cvode", atol=REFERENCE_ATOL)
+    print(f"    reference (cvode atol={REFERENCE_ATOL}): {runtime} s, saved to {filename}")
+    os.makedirs(REFERENCE_DIRECTORY, exist_ok=True)
+    np.save(filename, values)
+    return values
+
+
+def benchmark(model_factory, dx):
+    model = model_factory(dx)
+    h.finitialize(-65 * mV)
+    auto_dt = accurate_dt(rate_derivative=model["rate_derivative"])
+    print(f"{model['name']} at dx={dx}: accurate_dt = {auto_dt} ms")
+
+    reference = reference_values(model, dx)
+    cases = [("cvode", None, 1e-6), ("cvode", None, 1e-8), ("fixed", 0.025 * ms, None)] + [
+        ("fixed", factor * auto_dt, None) for factor in [0.5, 1, 2, 4]
+    ]
+    rows = []
+    for method, dt, atol in cases:
+        values, runtime, steps = run(model, method, dt=dt, atol=atol)
+        stable = bool(np.all(np.isfinite(values)))
+        error = float(np.max(np.abs(values - reference))) if stable else np.inf
+        print(f"    {method} dt={dt} atol={atol}: {runtime} s, {steps} steps, max error {error}")
+        rows.append(
+            {
+                "model": model["name"],
+                "dx": dx,
+                "method": method,
+                "dt": dt,
+                "atol": atol,
+                "accurate_dt": auto_dt,
+                "dt_over_accurate_dt": dt / auto_dt if dt else None,
+                "runtime": runtime,
+                "steps": steps,
+                "max_abs_error": error,
+                "finite": stable,
+            }
+        )
+    with sqlite3.connect(DB_FILENAME) as conn:
+        pd.DataFrame(rows).to_sql("data", conn, if_exists="append", index=False)
+
+
+if __name__ == "__main__":
+    for dx in [0.25, 0.125]:
+        for model_factory in [diffusion, bistable, hybrid]:
+            p = multiprocessing.Process(target=benchmark, args=(model_factory, dx))
+            p.start()
+            p.join()
+
+    with sqlite3.connect(DB_FILENAME) as conn:
+        data = pd.read_sql("SELECT * FROM data", conn)
+    print(data.groupby(["model", "dx", "method", "dt_over_accurate_dt", "atol"], dropna=False)[["runtime", "steps", "max_abs_error"]].min())
@@ -0,0 +1,139 @@
+"""Save and restore the full state of a NEURON + rxd simulation.
+
+A checkpoint is a single compressed .npz file holding
+  - the NEURON core state (h.SaveState: t, membrane potentials, mechanism
+    states, and the event queue), and
+  - the value of every node of every rxd Species, State and Parameter, 1D and
+    3D alike.
+
+Restoring requires the same model to have been built in the same order; call
+h.finitialize first, then restore(). With variable step integration CVODE is
+re-initialized from the restored state (its step size history is not saved,
+so the first steps after a restore start small).
+
+Example, resuming a long run after preemption:
+
+    h.finitialize(-65 * mV)
+    continuerun_with_checkpoints(1e5 * ms, "conservation.npz", interval=1000 * ms)
+"""
+import os
+import tempfile
+import numpy as np
+from neuron import h, rxd
+from neuron.rxd.node import Node3D, NodeExtracellular, _get_states
+
+
+def _all_species():
+    """every live Species/State/Parameter, in creation order, keyed by index and name"""
+    result = []
+    for i, ref in enumerate(rxd.species._all_species):
+        species = ref()
+        if species is not None:
+            result.append((f"{i}:{species.name}", species))
+    return result
+
+
+def _write_values(species, values):
+    """set species.nodes to values with one array assignment per state array
+
+    Setting node.value one node at a time goes through a Python property per
+    node, which dominates restoring a model with many voxels.
+    """
+    groups = {}
+    for position, node in enumerate(species.nodes):
+        if isinstance(node, Node3D):
+            key, index = ("3d", node._r), node._index
+        elif isinstance(node, NodeExtracellular):
+            key, index = ("extracellular", node._r), (node._i, node._j, node._k)
+        else:
+            key, index = ("1d", None), node._index
+        positions, indices = groups.setdefault(key, ([], []))
+        positions.append(position)
+        indices.append(index)
+    for (kind, region), (positions, indices) in groups.items():
+        if kind == "3d":
+            species._intracellular_instances[region].states[indices] = values[positions]
+        elif kind == "extracellular":
+            species[region].states3d[tuple(np.transpose(indices))] = values[positions]
+        else:
+            _get_states()[indices] = values[positions]
+
+
+def save(filename):
+    """write a checkpoint of the current simulation state to filename"""
+    ss = h.SaveState()
+    ss.save()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        core_filename = os.path.join(tmpdir, "core.dat")
+        f = h.File()
+        f.wopen(core_filename)
+        ss.fwrite(f)
+        with open(core_filename, "rb") as core_file:
+            core_state = np.frombuffer(core_file.read(), dtype=np.uint8)
+    arrays = {
+        f"species/{key}": np.array(species.nodes.value, dtype=float)
+        for key, species in _all_species()
+    }
+    # write to a temporary name first so a preemption mid-write leaves the
+    # previous checkpoint intact
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        np.savez_compressed(f, t=h.t, core_state=core_state, **arrays)
+    os.replace(tmp_filename, filename)
+
+
+def restore(filename):
+    """restore a checkpoint written by save(); the model must already be initialized"""
+    with np.load(filename) as data:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            core_filename = os.path.join(tmpdir, "core.dat")
+            with open(core_filename, "wb") as core_file:
+                core_file.write(data["core_state"].tobytes())
+            ss = h.SaveState()
+            f = h.File()
+            f.ropen(core_filename)
+            ss.fread(f)
+            ss.restore()
+
+        saved_keys = {key[len("species/"):] for key in data.files if key.startswith("species/")}
+        current = _all_species()
+        if saved_keys != {key for key, _ in current}:
+            raise ValueError(
+                f"checkpoint species {sorted(saved_keys)} do not match model species "
+                f"{sorted(key for key, _ in current)}"
+            )
+        for key, species in current:
+            values = data[f"species/{key}"]
+            nodes = species.nodes
+            if len(values) != len(nodes):
+                raise ValueError(f"checkpoint has {len(values)} nodes for {key}; model has {len(nodes)}")
+            _write_values(species, values)
+        h.t = float(data["t"])
+
+    if h.CVode().active():
+        h.CVode().re_init()
+
+
+def continuerun_with_checkpoints(tstop, filename, interval):
+    """h.continuerun(tstop), saving a checkpoint every interval ms of model time
+
+    If filename already exists, the run resumes from it instead of from the
+    current state. The model must be built and initialized before calling.
+    """
+    if os.path.exists(filename):
+        restore(filename)
+        print(f"resumed from {filename} at t = {h.t}")
+    while True:
+        # with fixed steps, continuerun stops within dt/2 of its stop time
+        end = tstop if h.CVode().active() else tstop - h.dt / 2
+        if h.t >= end:
+            break
+        next_stop = min(h.t + interval, tstop)
+        if h.CVode().active():
+            # do not step past the checkpoint time
+            h.CVode().event(next_stop)
+        start = h.t
+        h.continuerun(next_stop)
+        save(filename)
+        if h.stoprun or h.t == start:
+            break
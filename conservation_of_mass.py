@@ -3,9 +3,13 @@ from neuron.units import µm, ms, mV, nM, µM
 import plotnine as p9
 import pandas as pd
 import numpy as np
+from stop_conditions import StopConditions
 
 h.load_file("stdrun.hoc")
 
+# later tstops are skipped once the "maximum variation" is below this (mM)
+STEADY_STATE_TOLERANCE = 1e-12
+
 # create a Y-shaped geometry
 # we're letting NEURON pick the join angle, but this can be viewed
 # using an h.PlotShape
@@ -57,6 +61,10 @@ def do_analysis(method, tstops=np.logspace(0, 5) * ms):
     h.CVode().active(cvode_active)
     print(f"*** {method} step integration ***")
 
+    # stop once diffusion has flattened the profile; nothing changes after that
+    stop = StopConditions(check_interval=1 * ms)
+    stop.steady_state(ca, tolerance=STEADY_STATE_TOLERANCE, metric="variation")
+
     # initial membrane potential doesn't matter for this simulation
     # but initialization is required
     h.finitialize(-65 * mV)
@@ -65,6 +73,7 @@ def do_analysis(method, tstops=np.logspace(0, 5) * ms):
     print(f"After initialization, total calcium = {initial_total} mM * µm ** 3")
 
     # advance until tstop (event ensures variable step does not go past tstop)
+    times = []
     percent_changes = []
     for tstop in tstops:
         h.CVode().event(tstop)
@@ -72,6 +81,7 @@ def do_analysis(method, tstops=np.logspace(0, 5) * ms):
 
         ending_total = total_ca()
         percent_change = 100 * (initial_total - ending_total) / initial_total
+        times.append(h.t)
         percent_changes.append(abs(percent_change))
         print(f"At t = {h.t}, total calcium = {ending_total} mM * µm ** 3")
         print(f"    Change: {percent_change}%")
@@ -79,10 +89,14 @@ def do_analysis(method, tstops=np.logspace(0, 5) * ms):
             f"    Maximum variation: {max(ca.nodes.concentration) - min(ca.nodes.concentration)} mM"
         )
         print()
+        if stop.reason:
+            print(f"Stopped at t = {h.t}: {stop.reason}")
+            break
+    stop.remove()
 
     return p9.geom_line(
         data=pd.DataFrame(
-            {"t": tstops, "percent error": percent_changes, "method": method}
+            {"t": times, "percent error": percent_changes, "method": method}
         )
     )
 
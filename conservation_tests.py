@@ -1,11 +1,36 @@
 from neuron import h, rxd
-from matplotlib import pyplot
-from neuron.units import s, µm, nM, mV
-import pandas as pd
+from neuron.units import s, ms, µm, nM, mV
 import numpy as np
 import sqlite3
 import sys
-h.load_file('stdrun.hoc')
+import itertools
+import multiprocessing
+from profiling import add_missing_columns
+from stop_conditions import StopConditions
+
+DB_FILENAME = "conservation_tests.db"
+
+# configuration matrix for batch mode
+DXS = [0.25, 0.125, 0.0625]
+DTS = [0.025, 0.0125, 'cvode']
+SOURCES = ['1d', '3d']
+MODELS = ['line', 'split_align', 'split_y']
+
+# runs end at 100 s or once the concentration is this flat (max - min, mM)
+STEADY_STATE_TOLERANCE = 1e-9
+CHECK_INTERVAL = 100 * ms
+
+
+def run_to_steady_state(species):
+    """run to 100 s or to steady state; returns the initial amount and the time the run stopped"""
+    # loaded here rather than at import so batch workers start quickly
+    h.load_file('stdrun.hoc')
+    with StopConditions(check_interval=CHECK_INTERVAL) as stop:
+        stop.steady_state(species, tolerance=STEADY_STATE_TOLERANCE, metric="variation")
+        h.finitialize(-70 * mV)
+        initial_amount = (np.array(species.nodes.concentration) * np.array(species.nodes.volume)).sum()
+        h.continuerun(100 * s)
+    return initial_amount, h.t
 
 
 def line(dx=0.25, dt=0.025, source='1d', hybrid=False):
@@ -33,12 +58,10 @@ def line(dx=0.25, dt=0.025, source='1d', hybrid=False):
     ca = rxd.Species(r, d=diff_constant, atolscale=nM,
                         initial=lambda nd: 1 * µm if nd in source_sec and
                                                 nd.x < 0.75 else 0)
-    h.finitialize(-70 * mV)
-    initial_amount = (np.array(ca.nodes.concentration) * np.array(ca.nodes.volume)).sum()
-    h.continuerun(100 * s)
+    initial_amount, stop_time = run_to_steady_state(ca)
     final_amount = (np.array(ca.nodes.concentration) * np.array(ca.nodes.volume)).sum()
 
-    return initial_amount, final_amount
+    return initial_amount, final_amount, stop_time
 
 
 def split(dx=0.25, dt=0.025, align=False, source='1d', hybrid=False):
@@ -81,43 +104,35 @@ def split(dx=0.25, dt=0.025, align=False, source='1d', hybrid=False):
     ca = rxd.Species(r, d=diff_constant, atolscale=nM,
                         initial=lambda nd: 1 * µm if nd.sec in source_sec and 
                                                 nd.x < 0.75 else 0)
-    h.finitialize(-70 * mV)
-    initial_amount = (np.array(ca.nodes.concentration) * np.array(ca.nodes.volume)).sum()
-    h.continuerun(100 * s)
+    initial_amount, stop_time = run_to_steady_state(ca)
 
     final_amount = (np.array(ca.nodes.concentration) * np.array(ca.nodes.volume)).sum()
 
-    return initial_amount, final_amount
+    return initial_amount, final_amount, stop_time
 
 
-if __name__ == "__main__":
-    dx = float(sys.argv[1])
-    if 'cvode' in sys.argv[2]:
+def run_case(dx, dt, source, model, hybrid):
+    """run one configuration; return the name of its table and its row"""
+    if dt == 'cvode':
         h.CVode().active(True)
-        h.CVode().atol
-        dt = 'cvode'
     else:
-        dt = float(sys.argv[2])
+        h.CVode().active(False)
         h.dt = dt
-    source = sys.argv[3]
-    model = sys.argv[4]
-    hybrid = sys.argv[5] == 'hybrid'
     print(f"processing {model} in {hybrid} with dx={dx} dt={dt}")
-    conn = sqlite3.connect("conservation_tests.db")
     if model == "split_align":
-        initial_amount, final_amount = split(dx=dx, dt=dt, align=True,
+        initial_amount, final_amount, stop_time = split(dx=dx, dt=dt, align=True,
                                                     source=source,
                                                     hybrid=hybrid)
     elif model == "split_y":
-        initial_amount, final_amount = split(dx=dx, dt=dt, align=False,
+        initial_amount, final_amount, stop_time = split(dx=dx, dt=dt, align=False,
                                                     source=source,
                                                     hybrid=hybrid)
 
     else:
-        initial_amount, final_amount = line(dx=dx, dt=dt, source=source,
+        initial_amount, final_amount, stop_time = line(dx=dx, dt=dt, source=source,
                                                    hybrid=hybrid)
-   
-    data = pd.DataFrame({
+
+    return model, {
         "hybrid": hybrid,
         "dx": dx,
         "dt": dt,
@@ -125,8 +140,82 @@ if __name__ == "__main__":
         "initial": initial_amount,
         "final_amount": final_amount,
         "diff": initial_amount-final_amount,
-        "ratio": 1-final_amount/initial_amount
-    },index=[f"{source}_{dx}_{dt}_{hybrid}"])
-    data.to_sql(model, conn, if_exists="append", index=False)
+        "ratio": 1-final_amount/initial_amount,
+        "stop_time": stop_time,
+    }
+
+
+def run_case_in_worker(config):
+    """run_case in a pool worker; returns (config, table and row or None, error or None)"""
+    try:
+        return config, run_case(*config), None
+    except Exception as e:
+        # report it with the other failures once the rest of the matrix is done
+        return config, None, repr(e)
+
+
+def save_rows(results):
+    """store (model, row) pairs; all rows are written in a single transaction"""
+    with sqlite3.connect(DB_FILENAME) as conn:
+        for model in {model for model, _ in results}:
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{model}" '
+                "(hybrid INTEGER, dx REAL, dt, source TEXT, initial REAL, "
+                "final_amount REAL, diff REAL, ratio REAL, stop_time REAL)"
+            )
+            add_missing_columns(conn, f'"{model}"', ["stop_time"])
+        for model, row in results:
+            conn.execute(
+                f'INSERT INTO "{model}" ({", ".join(row)}) VALUES ({", ".join("?" * len(row))})',
+                tuple(row.values()),
+            )
+
+
+def done_configs():
+    """(dx, dt, source, model, hybrid) combinations already in the database"""
+    done = set()
+    with sqlite3.connect(DB_FILENAME) as conn:
+        for model in MODELS:
+            try:
+                rows = conn.execute(f'SELECT dx, dt, source, hybrid FROM "{model}"').fetchall()
+            except sqlite3.OperationalError:
+                continue
+            for dx, dt, source, hybrid in rows:
+                done.add((dx, dt, source, model, bool(hybrid)))
+    return done
+
+
+def run_batch(num_workers=None):
+    """run every configuration not yet in the database, each in a fresh worker process
+
+    rxd cannot be reset within a process, so a worker runs one case and exits.
+    """
+    done = done_configs()
+    configs = [
+        config
+        for config in itertools.product(DXS, DTS, SOURCES, MODELS, [True, False])
+        if config not in done
+    ]
+    print(f"{len(configs)} configurations to run ({len(done)} already done)")
+    with multiprocessing.Pool(num_workers, maxtasksperchild=1) as pool:
+        results = pool.map(run_case_in_worker, configs, chunksize=1)
+    save_rows([result for _, result, error in results if error is None])
+    failures = [(config, error) for config, _, error in results if error is not None]
+    if failures:
+        for config, error in failures:
+            print(f"failed: {config}: {error}")
+        raise RuntimeError(f"{len(failures)} of {len(configs)} configurations failed")
 
 
+if __name__ == "__main__":
+    # python conservation_tests.py dx dt source model hybrid  -- one configuration
+    # python conservation_tests.py batch [num_workers]       -- the full matrix
+    if sys.argv[1] == "batch":
+        run_batch(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        sys.exit()
+    dx = float(sys.argv[1])
+    dt = 'cvode' if 'cvode' in sys.argv[2] else float(sys.argv[2])
+    source = sys.argv[3]
+    model = sys.argv[4]
+    hybrid = sys.argv[5] == 'hybrid'
+    save_rows([run_case(dx, dt, source, model, hybrid)])
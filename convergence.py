@@ -0,0 +1,142 @@
+"""Observed order of convergence and Richardson-extrapolated limits.
+
+get_timings.py measures errors against the smallest-dx run of each
+morphology, which is also by far the most expensive one. Instead, fit
+
+    value(dx) = limit + C * dx ** order
+
+to the runs at (three or more) coarser dx: richardson() returns the
+extrapolated limit, the observed order, and an uncertainty for the limit, so
+relative errors can be reported without the finest run. The uncertainty is
+(safety_factor - 1) * |finest value - limit|, the margin the grid convergence
+index puts on the extrapolated correction; with four or more dx it is at least
+the jackknife standard error of the limit over leave-one-out refits.
+
+    python convergence.py [min_dx]   -- orders and limits per morphology from
+                                        discretization.db using only dx >= min_dx
+"""
+import sqlite3
+import sys
+import numpy as np
+import pandas as pd
+
+SAFETY_FACTOR = 1.25
+MIN_ORDER = 0.25
+MAX_ORDER = 6
+
+
+def _fit_at_order(dx, values, order):
+    design = np.column_stack([np.ones_like(dx), dx ** order])
+    (limit, coefficient), *_ = np.linalg.lstsq(design, values, rcond=None)
+    residual = np.sum((design @ (limit, coefficient) - values) ** 2)
+    return limit, coefficient, residual
+
+
+def fit(dx, values, min_order=MIN_ORDER, max_order=MAX_ORDER):
+    """least-squares (limit, coefficient, order) for value = limit + coefficient * dx ** order
+
+    The order is found by a grid search over [min_order, max_order] refined by
+    golden-section search; an order at either bound means the data are not in
+    the asymptotic range (e.g. the errors change sign).
+    """
+    dx = np.asarray(dx, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(np.unique(dx)) < 3:
+        raise ValueError("need at least three distinct dx to fit an order")
+    # work relative to the largest dx so dx ** order stays well scaled
+    scale = dx.max()
+    scaled = dx / scale
+
+    orders = np.linspace(min_order, max_order, 200)
+    residuals = [_fit_at_order(scaled, values, order)[2] for order in orders]
+    i = int(np.argmin(residuals))
+    low, high = orders[max(i - 1, 0)], orders[min(i + 1, len(orders) - 1)]
+    ratio = (np.sqrt(5) - 1) / 2
+    for _ in range(60):
+        a = high - ratio * (high - low)
+        b = low + ratio * (high - low)
+        if _fit_at_order(scaled, values, a)[2] < _fit_at_order(scaled, values, b)[2]:
+            high = b
+        else:
+            low = a
+    order = (low + high) / 2
+    limit, coefficient, _ = _fit_at_order(scaled, values, order)
+    return limit, coefficient / scale ** order, order
+
+
+def richardson(dx, values, safety_factor=SAFETY_FACTOR):
+    """extrapolated limit, observed order, and uncertainty of the limit
+
+    Returns a dict with limit, order, uncertainty, coefficient and num_points.
+    """
+    dx = np.asarray(dx, dtype=float)
+    values = np.asarray(values, dtype=float)
+    limit, coefficient, order = fit(dx, values)
+    finest = values[np.argmin(dx)]
+    uncertainty = (safety_factor - 1) * abs(finest - limit)
+    if len(dx) >= 4:
+        # jackknife over the runs: how much the limit depends on any one of them
+        loo = []
+        for i in range(len(dx)):
+            keep = np.arange(len(dx)) != i
+            if len(np.unique(dx[keep])) >= 3:
+                loo.append(fit(dx[keep], values[keep])[0])
+        if len(loo) > 1:
+            loo = np.array(loo)
+            jackknife = np.sqrt((len(loo) - 1) / len(loo) * np.sum((loo - loo.mean()) ** 2))
+            uncertainty = max(uncertainty, jackknife)
+    return {
+        "limit": limit,
+        "order": order,
+        "uncertainty": uncertainty,
+        "coefficient": coefficient,
+        "num_points": len(dx),
+    }
+
+
+def extrapolate(data, by, x, y, min_x=None):
+    """richardson() for each group of data
+
+    data -- a DataFrame with one row per run
+    by -- column(s) identifying a group (e.g. "morphology")
+    x, y -- the discretization column (dx) and the measured column (volume)
+    min_x -- ignore runs with x below this (e.g. to leave out the finest runs)
+
+    Groups with fewer than three distinct x are left out.
+    """
+    if min_x is not None:
+        data = data[data[x] >= min_x]
+    rows = []
+    for key, group in data.groupby(by):
+        if group[x].nunique() < 3:
+            continue
+        result = richardson(group[x], group[y])
+        result.update(dict(zip([by] if isinstance(by, str) else by, [key] if isinstance(by, str) else key)))
+        rows.append(result)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    min_dx = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    with sqlite3.connect("discretization.db") as conn:
+        data = pd.read_sql("SELECT * FROM morphology", conn)
+    data = data.drop_duplicates(subset=["morphology", "dx"])
+    finest = data.loc[data.groupby("morphology")["dx"].idxmin()].set_index("morphology")
+    for y in ["volume", "surface_area"]:
+        limits = extrapolate(data, "morphology", "dx", y, min_x=min_dx).set_index("morphology")
+        print(f"{y}: observed order {limits['order'].median():.2f} "
+              f"(interquartile range {limits['order'].quantile(0.25):.2f}-{limits['order'].quantile(0.75):.2f}, "
+              f"{len(limits)} morphologies)")
+        if min_dx is not None:
+            # check the extrapolation against the finest runs that were left out
+            left_out = finest.loc[limits.index]
+            left_out = left_out[left_out["dx"] < min_dx]
+            if len(left_out):
+                limit = limits.loc[left_out.index]
+                difference = 100 * abs(left_out[y] - limit["limit"]) / limit["limit"]
+                predicted = limit["limit"] + limit["coefficient"] * left_out["dx"] ** limit["order"]
+                covered = abs(left_out[y] - predicted) <= limit["uncertainty"]
+                print(f"    finest run differs from the limit by {difference.median():.3f}% (median); "
+                      f"within the error bars for {covered.sum()} of {len(left_out)}")
+        for morphology, row in limits.iterrows():
+            print(f"    {morphology}: {row['limit']:.6g} ± {row['uncertainty']:.2g}, order {row['order']:.2f}")
@@ -1,19 +1,17 @@
 import multiprocessing
 import random
 import sqlite3
-import pandas as pd
 from neuron import h, rxd
 import sys
 
-h.load_file("stdrun.hoc")
-
 NUM_ORIENTATIONS = 1000
 
+# (theta, phi, dx) already in the database; read without pandas to keep workers light
 try:
     with sqlite3.connect("cylinder_convergence.db") as conn:
-        old_data = pd.read_sql("SELECT * FROM data", conn)
-except:
-    old_data = pd.DataFrame({"theta": [], "phi": [], "volume": [], "area": [], "dx": []})
+        done = set(conn.execute("SELECT theta, phi, dx FROM data"))
+except sqlite3.OperationalError:
+    done = set()
 
 
 def save_data(theta, phi, dx, volume, area):
@@ -46,8 +44,6 @@ def run_sim(theta, phi, dx, L=5, diam=2):
     # theta, phi are polar angle and azimuthal angle, respectively
     # per ISO 80000-2:2019... this is physics style not math convention
     # theta \in [0, \pi), phi \in [0, 2*pi)
-    import numpy as np
-
 
     # setup the model geometry
     dend = h.Section(name="dend")
@@ -85,12 +81,32 @@ if __name__ == "__main__":
         for _ in range(NUM_ORIENTATIONS)
     ]
 
+    dxs = [2**-1, 2**-1.5, 2**-2, 2**-2.5, 2**-3, 2**-3.5, 2**-4]
+
+    def already_done(theta, phi, dx):
+        return (theta, phi, dx) in done
+
+    if sys.argv[1] == "queue":
+        # python cylinder_convergence.py queue [queue_file]
+        # run on as many machines as wanted; each claims grid points from the shared queue
+        from job_queue import JobQueue, QUEUE_FILENAME
+
+        queue = JobQueue(sys.argv[2] if len(sys.argv) > 2 else QUEUE_FILENAME, "cylinder_convergence")
+        queue.add(
+            {"theta": theta, "phi": phi, "dx": dx}
+            for dx in dxs
+            for theta, phi in orientations
+            if not already_done(theta, phi, dx)
+        )
+        queue.run_worker(run_sim)
+        sys.exit()
+
     # do the parameter study
     start_i = int(sys.argv[1])
     stop_i = int(sys.argv[2])
-    for dx in [2**-1, 2**-1.5, 2**-2, 2**-2.5, 2**-3, 2**-3.5, 2**-4]:
+    for dx in dxs:
         for theta, phi in orientations[start_i:stop_i]:
-            if any((old_data["dx"] == dx) & (old_data["theta"] == theta) & (old_data["phi"] == phi)):
+            if already_done(theta, phi, dx):
                 print(f"Skipping: dx={dx}, theta={theta}, phi={phi}")
             else:
                 print(f"Running: dx={dx}, theta={theta}, phi={phi}")
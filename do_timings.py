@@ -1,20 +1,70 @@
 import os
 import sys
+import time
+import subprocess
 import pandas as pd
 import sqlite3
 base_dir = "swc"
 
-dx = float(sys.argv[1])
-for filename in os.listdir(base_dir):
-    # TODO: skip if already in the db
-    # skip hidden files
+# usage: python do_timings.py dx [num_jobs] [fork]
+# morphologies are run largest-first, num_jobs at a time, each job pinned to its own core.
+# With "fork", each job is a fork of this process with NEURON and time_discretization
+# already loaded (see fork_server.py) instead of a new interpreter.
+
+use_fork = "fork" in sys.argv[1:]
+args = [arg for arg in sys.argv[1:] if arg != "fork"]
+dx = float(args[0])
+cores = sorted(os.sched_getaffinity(0))
+num_jobs = int(args[1]) if len(args) > 1 else len(cores)
+if num_jobs > len(cores):
+    raise ValueError(f"only {len(cores)} cores available for {num_jobs} jobs")
+
+try:
     with sqlite3.connect("discretization.db") as conn:
-        old_data = pd.read_sql("SELECT * FROM morphology", conn)
+        old_data = pd.read_sql("SELECT morphology, dx FROM morphology", conn)
+except pd.errors.DatabaseError:
+    old_data = pd.DataFrame({"morphology": [], "dx": []})
 
-    if any((old_data["dx"] == dx) & (old_data["morphology"] == os.path.join(base_dir, filename))):
+pending = []
+for filename in os.listdir(base_dir):
+    # skip hidden files
+    if filename.startswith("."):
+        continue
+    true_filename = os.path.join(base_dir, filename)
+    if any((old_data["dx"] == dx) & (old_data["morphology"] == true_filename)):
         print(f"skipping: dx: {dx}, morph: {filename}")
         continue
+    pending.append(true_filename)
+
+# file size is a good enough proxy for discretization cost; start the big ones first
+# so a slow morphology does not end up running alone at the end
+pending.sort(key=os.path.getsize, reverse=True)
+
+if use_fork:
+    from fork_server import ForkServer
+
+    server = ForkServer(preload=["time_discretization"], hoc_files=["import3d.hoc"])
+    run_discretization = server.modules["time_discretization"].run
 
-    if not filename.startswith("."):
-        true_filename = os.path.join(base_dir, filename)
-        os.system(f"python time_discretization.py {true_filename} {dx}")
+free_cores = cores[:num_jobs]
+running = {}
+while pending or running:
+    while pending and free_cores:
+        true_filename = pending.pop(0)
+        core = free_cores.pop(0)
+        print(f"starting: dx: {dx}, morph: {true_filename} on core {core}")
+        if use_fork:
+            p = server.start(run_discretization, true_filename, dx, cpu=core)
+        else:
+            p = subprocess.Popen(
+                [sys.executable, "time_discretization.py", true_filename, str(dx)],
+                preexec_fn=lambda core=core: os.sched_setaffinity(0, {core}),
+            )
+        running[core] = (true_filename, p)
+    for core, (true_filename, p) in list(running.items()):
+        if p.poll() is not None:
+            if p.returncode:
+                print(f"failed (exit code {p.returncode}): {true_filename}")
+            del running[core]
+            free_cores.append(core)
+    time.sleep(0.1)
@@ -8,6 +8,7 @@ import numpy as np
 import math
 from matplotlib import pyplot
 import os
+from voxel_recorder import VoxelRecorder
 
 try:
     os.makedirs("concentration_plots")
@@ -221,16 +222,16 @@ def get_time_above_threshold(data, threshold, times):
 
 
 def plot_max_concs(species, label, t=50 * ms, color='blue'):
-    node_vectors = [h.Vector().record(node._ref_concentration) for node in species]
-    times = h.Vector().record(h._ref_t)
+    # every step of every node, into one preallocated array
+    recorder = VoxelRecorder(species, decimation=1, tstop=t)
     h.finitialize(-65 * mV)
     h.continuerun(t)
-    ts = [element for element in times]
+    ts = list(recorder.t[:recorder.num_samples])
     blueplot = []
     redplot = []
     bp = []
     rp =[]
-    maxes = [max(values) for values in zip(*node_vectors)]
+    maxes = list(recorder.data.max(axis=1))
     data = np.array(maxes)
     threshold = 0.15
     pyplot.plot(ts, maxes, color=color, label=label)
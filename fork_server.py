@@ -0,0 +1,122 @@
+"""Run each configuration in a fork of a preloaded, pristine template process.
+
+The sweeps give every configuration its own process so NEURON's global state
+(sections, rxd species, options) never leaks from one run into the next. A
+fresh interpreter per run, as do_timings.py used to start, pays for Python
+startup, `from neuron import h, rxd`, hoc files and compiled mechanisms each
+time. ForkServer does that work once in the calling process, which then only
+forks: each child starts with everything loaded, shares the template's memory
+copy-on-write, and exits when its run is done, leaving the template untouched.
+
+    server = ForkServer(preload=["time_discretization"], hoc_files=["import3d.hoc"])
+    child = server.start(time_discretization.run, "swc/cell.swc", 0.25, cpu=3)
+    child.wait()
+
+start() refuses to fork once the template holds any sections or rxd species,
+since every child would inherit them. Children are started with os.fork
+directly, independent of multiprocessing's default start method (which is no
+longer "fork" on every platform and Python version).
+
+    python fork_server.py   -- compare the launch cost with a fresh interpreter
+"""
+import importlib
+import os
+import subprocess
+import sys
+import time
+import traceback
+from neuron import h, rxd
+
+
+class Child:
+    """a forked run, with the parts of the subprocess.Popen interface the drivers use"""
+
+    def __init__(self, pid, args):
+        self.pid = pid
+        self.args = args
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+
+class ForkServer:
+    def __init__(self, preload=(), hoc_files=("stdrun.hoc",), mechanisms=()):
+        """preload -- modules to import (e.g. the script whose function is run)
+        hoc_files -- hoc files to load
+        mechanisms -- compiled mechanism libraries to load with nrn_load_dll,
+            beyond those NEURON loads automatically from the working directory
+        """
+        for filename in hoc_files:
+            h.load_file(filename)
+        for filename in mechanisms:
+            h.nrn_load_dll(filename)
+        self.modules = {name: importlib.import_module(name) for name in preload}
+
+    def check_pristine(self):
+        if any(True for _ in h.allsec()):
+            raise RuntimeError("the template has sections; build models only in the children")
+        if any(ref() is not None for ref in rxd.species._all_species):
+            raise RuntimeError("the template has rxd species; build models only in the children")
+
+    def start(self, target, *args, cpu=None, **kwargs):
+        """run target(*args, **kwargs) in a forked child, optionally pinned to one cpu"""
+        self.check_pristine()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            return Child(pid, args)
+        exit_code = 0
+        try:
+            if cpu is not None:
+                os.sched_setaffinity(0, {cpu})
+            target(*args, **kwargs)
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # skip the template's atexit handlers and buffered state
+            os._exit(exit_code)
+
+    def run(self, target, *args, **kwargs):
+        """run target in a forked child and wait for it; returns the exit code"""
+        return self.start(target, *args, **kwargs).wait()
+
+
+def _noop():
+    pass
+
+
+if __name__ == "__main__":
+    num_runs = 20
+    start = time.perf_counter()
+    server = ForkServer()
+    setup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(num_runs):
+        server.run(_noop)
+    fork_time = (time.perf_counter() - start) / num_runs
+
+    start = time.perf_counter()
+    for _ in range(num_runs):
+        subprocess.run([sys.executable, "-c", "from neuron import h, rxd; h.load_file('stdrun.hoc')"], check=True)
+    fresh_time = (time.perf_counter() - start) / num_runs
+
+    print(f"template setup (hoc files, once): {setup_time:.3f} s")
+    print(f"launch per run: fork {1000 * fork_time:.2f} ms, fresh interpreter {1000 * fresh_time:.2f} ms")
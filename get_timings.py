@@ -1,82 +1,177 @@
 import plotnine as p9
 import pandas as pd
+import numpy as np
 import sqlite3
 import itertools
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import convergence
+from convergence import extrapolate
 
-if __name__ == "__main__":
-    conn = sqlite3.connect("discretization.db")
-    data = pd.read_sql("SELECT * FROM morphology", conn)
-    data = data.drop_duplicates(subset=["morphology", "dx"])
+# Derived tables are cached under measurements/.cache keyed by a hash of the
+# rows they were computed from and of the code deriving them, and each figure
+# is only re-rendered when the hash of its input columns (or of that code)
+# changes. Run with "force" to recompute and re-render everything.
+FIGURE_DIR = "measurements"
+CACHE_DIR = os.path.join(FIGURE_DIR, ".cache")
+MANIFEST_FILENAME = os.path.join(CACHE_DIR, "figures.json")
+
+MY_VARS = [
+    "volume",
+    "surface_area",
+    "num_voxels",
+    "num_surface_voxels",
+    "discretization_time",
+    "length_ratio",
+    "num_sections"
+]
+
+def files_hash(filenames):
+    digest = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# this script and convergence.py, which derive_morphology uses
+SOURCE_HASH = files_hash([__file__, convergence.__file__])
+
+
+def frame_hash(frame):
+    digest = hashlib.sha256(",".join(map(str, frame.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def cached(conn, table, derive, force=False):
+    """derive(rows of table), reusing the result from an earlier run if neither
+    the rows nor the code have changed (unless force)"""
+    try:
+        raw = pd.read_sql(f"SELECT * FROM {table}", conn)
+    except pd.errors.DatabaseError:
+        return pd.DataFrame()
+    key = hashlib.sha256(f"{SOURCE_HASH} {frame_hash(raw)}".encode()).hexdigest()
+    cache_filename = os.path.join(CACHE_DIR, f"{table}-{key}.pkl")
+    if not force and os.path.exists(cache_filename):
+        return pd.read_pickle(cache_filename)
+    result = derive(raw)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for old in glob.glob(os.path.join(CACHE_DIR, f"{table}-*.pkl")):
+        os.remove(old)
+    result.to_pickle(cache_filename)
+    return result
+
+
+def derive_morphology(data):
+    data = data.drop_duplicates(subset=["morphology", "dx"]).reset_index(drop=True)
     data["length_ratio"] = data["sum_lengths"] / data["dx"]
-    best_data = {}
-    for row in data.itertuples():
-        if row.morphology in best_data and row.dx >= best_data[row.morphology].dx:
-            continue
-        best_data[row.morphology] = row
-    not_best_rows = [row.dx != best_data[row.morphology].dx for row in data.itertuples()]
-    data["best_volume"] = [best_data[row.morphology].volume for row in data.itertuples()]
-    data["best_surface_area"] = [best_data[row.morphology].surface_area for row in data.itertuples()]
+    # the smallest dx for each morphology is the reference
+    best = data.loc[data.groupby("morphology")["dx"].idxmin(), ["morphology", "dx", "volume", "surface_area"]]
+    best = best.rename(columns={"dx": "best_dx", "volume": "best_volume", "surface_area": "best_surface_area"})
+    data = data.merge(best, on="morphology", how="left")
+    data["is_best"] = data["dx"] == data["best_dx"]
     data["abs_volume_error"] = abs(data["volume"] - data["best_volume"])
     data["abs_surface_area_error"] = abs(data["surface_area"] - data["best_surface_area"])
-    data["morphology"] = data["morphology"].apply(lambda filename: filename[4:-12])
     data["relative_volume_error"] = 100 * data["abs_volume_error"] / data["best_volume"]
     data["relative_surface_area_error"] = (
         100 * data["abs_surface_area_error"] / data["best_surface_area"]
     )
-    
-    p9.options.figure_size = (3.5, 3.5)
+    # the same errors against the Richardson-extrapolated limit, which does not need the finest run
+    for y_var in ["volume", "surface_area"]:
+        limits = extrapolate(data, "morphology", "dx", y_var)
+        if not len(limits):
+            continue
+        limits = limits.rename(columns={
+            "limit": f"extrapolated_{y_var}",
+            "uncertainty": f"extrapolated_{y_var}_uncertainty",
+            "order": f"{y_var}_order",
+        })[["morphology", f"extrapolated_{y_var}", f"extrapolated_{y_var}_uncertainty", f"{y_var}_order"]]
+        data = data.merge(limits, on="morphology", how="left")
+        data[f"extrapolated_relative_{y_var}_error"] = (
+            100 * abs(data[y_var] - data[f"extrapolated_{y_var}"]) / data[f"extrapolated_{y_var}"]
+        )
+        data[f"extrapolated_relative_{y_var}_error_uncertainty"] = (
+            100 * data[f"extrapolated_{y_var}_uncertainty"] / data[f"extrapolated_{y_var}"]
+        )
+    data["morphology"] = data["morphology"].str[4:-12]
+    return data
 
-    # plot volume errors
-    for y_var in [
-        "abs_volume_error",
-        "relative_volume_error",
-        "abs_surface_area_error",
-        "relative_surface_area_error",
-    ]:
-        for mode in ["", "_smooth"]:
-            plot = (
-                p9.ggplot(
-                    data[not_best_rows], p9.aes(x="dx", y=y_var, color="morphology")
-                )
-                + p9.geom_point()
-            )
-            if mode == "":
-                plot = plot + p9.geom_line()
-            else:
-                plot = plot + p9.geom_smooth(method="lm", se=False)
-
-
-            plot = (
-                plot
-                + p9.scale_x_log10()
-                + p9.scale_y_log10()
-                + p9.xlab("dx (µm)")
-            )
-            if y_var == "relative_volume_error":
-                plot = (
-                    plot
-                    + p9.geom_abline(slope=1, intercept=2, size=1)
-                    + p9.geom_abline(slope=2, intercept=0.5, size=1)
-                    + p9.geom_abline(slope=3, intercept=-1, size=1)
-                )
-            if y_var == "relative_surface_area_error":
-                plot = (
-                    plot
-                    + p9.geom_abline(slope=1, intercept=3, size=1)
-                    + p9.geom_abline(slope=2, intercept=1, size=1)
-                    + p9.geom_abline(slope=3, intercept=-1, size=1)
-                )
-                        
-            if y_var == "relative_volume_error":
-                plot = plot + p9.ylab("Estimated Relative Volume Error (%)")
-            elif y_var == "relative_surface_area_error":
-                plot = plot + p9.ylab("Estimated Relative Surface Area Error (%)")
-
-            plot.save(f"measurements/{y_var}{mode}.pdf")
-
-    (
+
+def derive_phases(phases):
+    phases = phases.dropna(subset=["wall_time"])
+    phases = phases[phases["wall_time"] > 0].drop_duplicates(subset=["morphology", "dx", "phase"])
+    phases["morphology"] = phases["morphology"].str[4:-12]
+    return phases
+
+
+def error_plot(data, y_var, mode):
+    plot = (
         p9.ggplot(
-            data[not_best_rows], p9.aes(x="discretization_time", y="relative_volume_error", color="morphology")
+            data, p9.aes(x="dx", y=y_var, color="morphology")
+        )
+        + p9.geom_point()
+    )
+    if mode == "":
+        plot = plot + p9.geom_line()
+    else:
+        plot = plot + p9.geom_smooth(method="lm", se=False)
+
+    plot = (
+        plot
+        + p9.scale_x_log10()
+        + p9.scale_y_log10()
+        + p9.xlab("dx (µm)")
+    )
+    if y_var == "relative_volume_error":
+        plot = (
+            plot
+            + p9.geom_abline(slope=1, intercept=2, size=1)
+            + p9.geom_abline(slope=2, intercept=0.5, size=1)
+            + p9.geom_abline(slope=3, intercept=-1, size=1)
+        )
+    if y_var == "relative_surface_area_error":
+        plot = (
+            plot
+            + p9.geom_abline(slope=1, intercept=3, size=1)
+            + p9.geom_abline(slope=2, intercept=1, size=1)
+            + p9.geom_abline(slope=3, intercept=-1, size=1)
+        )
+
+    if y_var == "relative_volume_error":
+        plot = plot + p9.ylab("Estimated Relative Volume Error (%)")
+    elif y_var == "relative_surface_area_error":
+        plot = plot + p9.ylab("Estimated Relative Surface Area Error (%)")
+    return plot
+
+
+def extrapolated_error_plot(data, y_var, label):
+    error = f"extrapolated_relative_{y_var}_error"
+    uncertainty = f"{error}_uncertainty"
+    data = data.assign(
+        low=(data[error] - data[uncertainty]).clip(lower=data[error] / 10),
+        high=data[error] + data[uncertainty],
+    )
+    return (
+        p9.ggplot(data, p9.aes(x="dx", y=error, color="morphology"))
+        + p9.geom_point()
+        + p9.geom_line()
+        + p9.geom_errorbar(p9.aes(ymin="low", ymax="high"), width=0.02)
+        + p9.scale_x_log10()
+        + p9.scale_y_log10()
+        + p9.xlab("dx (µm)")
+        + p9.ylab(f"Relative {label} Error vs. Extrapolated (%)")
+    )
+
+
+def volume_error_vs_time_plot(data):
+    return (
+        p9.ggplot(
+            data, p9.aes(x="discretization_time", y="relative_volume_error", color="morphology")
         )
         #+ p9.geom_line()
         + p9.geom_point()
@@ -87,58 +182,207 @@ if __name__ == "__main__":
         + p9.geom_smooth(method="lm", se=False)
         + p9.ylab("Estimated Relative Volume Error (%)")
         + p9.xlab("Discretization Time (s)")
-    ).save(f"measurements/volume_error_vs_time.pdf")
-
-    my_vars = [
-        "volume",
-        "surface_area",
-        "num_voxels",
-        "num_surface_voxels",
-        "discretization_time",
-        "length_ratio",
-        "num_sections"
-    ]
+    )
 
-    # skipping num_sections because it does not depend on dx
-    for y_var in set(my_vars) - {"num_sections"}:
+
+def vs_dx_plot(data, y_var):
+    plot = (
+        p9.ggplot(data, p9.aes(x="dx", y=y_var, color="morphology"))
+        + p9.geom_point()
+        + p9.geom_line()
+        + p9.scale_x_log10()
+        + p9.scale_y_log10()
+        + p9.xlab("dx (µm)")
+    )
+    if y_var == "discretization_time":
         plot = (
-            p9.ggplot(data, p9.aes(x="dx", y=y_var, color="morphology"))
-            + p9.geom_point()
-            + p9.geom_line()
-            + p9.scale_x_log10()
-            + p9.scale_y_log10()
-            + p9.xlab("dx (µm)")
+            plot + p9.ylab("Discretization Time (s)")
+            #+ p9.geom_abline(slope=-1, intercept=0, size=1)
+            + p9.geom_abline(slope=-2, intercept=1, size=1)
+            #+ p9.geom_abline(slope=-3, intercept=2, size=1)
         )
-        if y_var == "discretization_time":
-            plot = (
-                plot + p9.ylab("Discretization Time (s)")
-                #+ p9.geom_abline(slope=-1, intercept=0, size=1)
-                + p9.geom_abline(slope=-2, intercept=1, size=1)
-                #+ p9.geom_abline(slope=-3, intercept=2, size=1)            
-            )
-        elif y_var == "relative_volume_error":
-            plot = plot + p9.ylab("Estimated Relative Volume Error (%)")
-        elif y_var == "relative_surface_area_error":
-            plot = plot + p9.ylab("Estimated Relative Surface Area Error (%)")
-        plot.save(f"measurements/{y_var}_vs_dx.pdf")
-    
+    return plot
+
+
+def memory_plot(data, x_var, x_label):
+    # memory next to time, for sizing jobs (columns recorded by time_discretization.py)
+    memory_data = data.dropna(subset=["build_peak_rss"]).copy()
+    memory_data["build_peak_rss"] /= 2 ** 20
+    memory_data["build_rss"] /= 2 ** 20
+    memory_data = pd.melt(
+        memory_data,
+        id_vars=["morphology", "dx", "num_voxels"],
+        value_vars=["discretization_time", "build_peak_rss", "build_rss", "build_bytes_per_voxel"],
+        var_name="measurement",
+    )
+    memory_data["measurement"] = memory_data["measurement"].apply(
+        lambda name: {
+            "discretization_time": "Discretization Time (s)",
+            "build_peak_rss": "Peak RSS (MiB)",
+            "build_rss": "RSS After Build (MiB)",
+            "build_bytes_per_voxel": "Bytes per Voxel",
+        }[name]
+    )
+    return (
+        p9.ggplot(memory_data, p9.aes(x=x_var, y="value", color="morphology"))
+        + p9.geom_point()
+        + p9.geom_line()
+        + p9.facet_wrap("measurement", scales="free_y")
+        + p9.scale_x_log10()
+        + p9.scale_y_log10()
+        + p9.xlab(x_label)
+        + p9.ylab("")
+    )
+
+
+def phase_plot(phases):
+    return (
+        p9.ggplot(phases, p9.aes(x="dx", y="wall_time", color="morphology"))
+        + p9.geom_point()
+        + p9.geom_line()
+        + p9.facet_wrap("phase")
+        + p9.scale_x_log10()
+        + p9.scale_y_log10()
+        + p9.xlab("dx (µm)")
+        + p9.ylab("Wall Time (s)")
+    )
+
 
+def pair_plot(data, x_var, y_var):
+    data = data.copy()
     data["dx"] = data["dx"].astype("category")
+    plot = (
+        p9.ggplot(data, p9.aes(x=x_var, y=y_var, color="morphology", shape="dx"))
+        + p9.geom_point()
+        + p9.scale_x_log10()
+        + p9.scale_y_log10()
+    )
+    if y_var == "discretization_time":
+        plot = plot + p9.ylab("Discretization Time (s)")
+    return plot
+
+
+def figure_jobs(data, phases):
+    """(filename, plot function, input data, keyword arguments, figure size) for each figure
+
+    Each figure gets only the columns it plots, so it is re-rendered only
+    when those change.
+    """
+    jobs = []
+    not_best = data[~data["is_best"]]
+    for y_var in [
+        "abs_volume_error",
+        "relative_volume_error",
+        "abs_surface_area_error",
+        "relative_surface_area_error",
+    ]:
+        for mode in ["", "_smooth"]:
+            jobs.append((f"{y_var}{mode}.pdf", error_plot, not_best[["dx", y_var, "morphology"]], {"y_var": y_var, "mode": mode}, (3.5, 3.5)))
+
+    for y_var, label in [("volume", "Volume"), ("surface_area", "Surface Area")]:
+        error = f"extrapolated_relative_{y_var}_error"
+        if error in data:
+            jobs.append((
+                f"{error}.pdf", extrapolated_error_plot,
+                data[["dx", "morphology", error, f"{error}_uncertainty"]].dropna(), {"y_var": y_var, "label": label}, (3.5, 3.5)
+            ))
+
+    jobs.append((
+        "volume_error_vs_time.pdf", volume_error_vs_time_plot,
+        not_best[["discretization_time", "relative_volume_error", "morphology"]], {}, (3.5, 3.5)
+    ))
 
-    for x_var, y_var in itertools.combinations(my_vars, 2):
+    # skipping num_sections because it does not depend on dx
+    for y_var in set(MY_VARS) - {"num_sections"}:
+        jobs.append((f"{y_var}_vs_dx.pdf", vs_dx_plot, data[["dx", y_var, "morphology"]], {"y_var": y_var}, (3.5, 3.5)))
+
+    if "build_peak_rss" in data:
+        memory_columns = [
+            "morphology", "dx", "num_voxels", "discretization_time", "build_peak_rss", "build_rss", "build_bytes_per_voxel"
+        ]
+        for x_var, x_label in [("dx", "dx (µm)"), ("num_voxels", "Number of Voxels")]:
+            jobs.append((
+                f"memory_and_time_vs_{x_var}.pdf", memory_plot, data[memory_columns],
+                {"x_var": x_var, "x_label": x_label}, (7, 7)
+            ))
+
+    if len(phases):
+        jobs.append(("phase_time_vs_dx.pdf", phase_plot, phases[["dx", "wall_time", "morphology", "phase"]], {}, (3.5, 3.5)))
+
+    for x_var, y_var in itertools.combinations(MY_VARS, 2):
         if x_var == "discretization_time":
             x_var, y_var = y_var, x_var
-        plot = (
-            p9.ggplot(data, p9.aes(x=x_var, y=y_var, color="morphology", shape="dx"))
-            + p9.geom_point()
-            + p9.scale_x_log10()
-            + p9.scale_y_log10()
-        )
-        if y_var == "discretization_time":
-            plot = plot + p9.ylab("Discretization Time (s)")
-        
-        plot.save(f"measurements/{y_var}_vs_{x_var}.pdf")
-    
+        jobs.append((
+            f"{y_var}_vs_{x_var}.pdf", pair_plot, data[[x_var, y_var, "morphology", "dx"]],
+            {"x_var": x_var, "y_var": y_var}, (3.5, 3.5)
+        ))
+    return jobs
+
+
+def render(job):
+    filename, plot_function, data, kwargs, figure_size = job
+    p9.options.figure_size = figure_size
+    plot_function(data, **kwargs).save(os.path.join(FIGURE_DIR, filename), verbose=False)
+    return filename
+
+
+def render_changed(jobs, force=False, num_workers=None):
+    """render, in a process pool, the figures whose inputs changed since the last run"""
+    try:
+        with open(MANIFEST_FILENAME) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    todo = []
+    keys = {}
+    for job in jobs:
+        filename, plot_function, data, kwargs, figure_size = job
+        keys[filename] = hashlib.sha256(
+            f"{SOURCE_HASH} {plot_function.__name__} {sorted(kwargs.items())} {figure_size} {frame_hash(data)}".encode()
+        ).hexdigest()
+        if force or manifest.get(filename) != keys[filename] or not os.path.exists(os.path.join(FIGURE_DIR, filename)):
+            todo.append(job)
+    print(f"rendering {len(todo)} of {len(jobs)} figures")
+    if todo:
+        with multiprocessing.Pool(num_workers) as pool:
+            for filename in pool.imap_unordered(render, todo):
+                manifest[filename] = keys[filename]
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(MANIFEST_FILENAME, "w") as f:
+            json.dump(manifest, f, indent=1)
+
+
+if __name__ == "__main__":
+    # python get_timings.py [force] [num_workers]
+    force = "force" in sys.argv[1:]
+    numbers = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+    num_workers = numbers[0] if numbers else None
+
+    conn = sqlite3.connect("discretization.db")
+    data = cached(conn, "morphology", derive_morphology, force=force)
+    # per-phase breakdown of the discretization time (recorded by time_discretization.py)
+    phases = cached(conn, "phases", derive_phases, force=force)
+
+    render_changed(figure_jobs(data, phases), force=force, num_workers=num_workers)
+
+    for y_var in ["volume", "surface_area"]:
+        if f"{y_var}_order" in data:
+            orders = data.drop_duplicates(subset=["morphology"])[f"{y_var}_order"].dropna()
+            print(f"Observed order of convergence of {y_var}: median {orders.median():.2f} "
+                  f"(interquartile range {orders.quantile(0.25):.2f}-{orders.quantile(0.75):.2f}, {len(orders)} morphologies)")
+
+    if len(phases):
+        # power-law exponent of time vs dx for each phase, fit per morphology
+        print("Discretization time ~ dx ** slope, by phase:")
+        for phase, phase_data in phases.groupby("phase"):
+            slopes = [
+                np.polyfit(np.log10(morph_data["dx"]), np.log10(morph_data["wall_time"]), 1)[0]
+                for _, morph_data in phase_data.groupby("morphology")
+                if morph_data["dx"].nunique() > 1
+            ]
+            if slopes:
+                print(f"    {phase}: slope = {np.mean(slopes):.3f} ± {np.std(slopes):.3f} ({len(slopes)} morphologies)")
+
     for dx in data["dx"].unique():
         if dx != min(data["dx"]):
             data_at_dx = data[data["dx"] == dx]
@@ -150,4 +394,4 @@ if __name__ == "__main__":
             below_1 = len(data_at_dx[data_at_dx["relative_volume_error"] < 1])
             below_01 = len(data_at_dx[data_at_dx["relative_volume_error"] < 0.1])
             print(f"At dx={dx}, {below_1} out of {len(data_at_dx)} morphologies had a rel volume error < 1%")
-            print(f"At dx={dx}, {below_01} out of {len(data_at_dx)} morphologies had a rel volume error < 0.1%")
\ No newline at end of file
+            print(f"At dx={dx}, {below_01} out of {len(data_at_dx)} morphologies had a rel volume error < 0.1%")
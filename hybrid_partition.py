@@ -0,0 +1,166 @@
+"""Choose which sections to simulate in 3D for a hybrid 1D/3D model.
+
+Given a region of interest (explicit sections, everything within a distance
+of a point, and/or everything touching a bounding box) and a voxel or memory
+budget, pick_3d_sections returns a list of sections suitable for
+rxd.set_solve_type(..., dimension=3). Neighboring sections are pulled into 3D
+when doing so removes 1D/3D junctions and the estimated voxel count stays
+within budget.
+"""
+import math
+from neuron import h
+
+
+def section_points(sec):
+    return [(sec.x3d(i), sec.y3d(i), sec.z3d(i), sec.diam3d(i)) for i in range(sec.n3d())]
+
+
+def estimate_voxels(sec, dx):
+    """estimate the number of 3D voxels a section will occupy at a given dx
+
+    Each pair of 3D points is treated as a frustum; every voxel inside it is
+    counted plus roughly half a voxel layer over its lateral surface for the
+    partial voxels at the boundary.
+    """
+    volume = 0
+    area = 0
+    pts = section_points(sec)
+    for (x0, y0, z0, d0), (x1, y1, z1, d1) in zip(pts[:-1], pts[1:]):
+        length = math.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2 + (z1 - z0) ** 2)
+        r0, r1 = d0 / 2, d1 / 2
+        volume += math.pi * length * (r0 ** 2 + r0 * r1 + r1 ** 2) / 3
+        area += math.pi * (r0 + r1) * math.sqrt((r1 - r0) ** 2 + length ** 2)
+    return int(math.ceil((volume + 0.5 * area * dx) / dx ** 3))
+
+
+def neighbors(sec):
+    """sections connected to sec (its parent and its children)"""
+    result = list(sec.children())
+    parent = sec.parentseg()
+    if parent is not None:
+        result.append(parent.sec)
+    return result
+
+
+def count_junctions(secs3d):
+    """number of parent-child connections with one side in 3D and the other in 1D"""
+    secs3d = set(secs3d)
+    return sum(1 for sec in secs3d for other in neighbors(sec) if other not in secs3d)
+
+
+def sections_in_roi(all_secs, sections=None, center=None, distance=None, bbox=None):
+    """sections belonging to a region of interest
+
+    sections -- sections always included
+    center, distance -- include sections whose center lies within distance of
+        center; center is either a segment (path distance, as h.distance) or an
+        (x, y, z) tuple (Euclidean distance to the nearest 3D point)
+    bbox -- ((xlo, ylo, zlo), (xhi, yhi, zhi)); include sections with any
+        3D point inside the box
+    """
+    roi = set(sections or [])
+    for sec in all_secs:
+        if center is not None and distance is not None:
+            if isinstance(center, tuple):
+                if any(
+                    math.sqrt((x - center[0]) ** 2 + (y - center[1]) ** 2 + (z - center[2]) ** 2) < distance
+                    for x, y, z, _ in section_points(sec)
+                ):
+                    roi.add(sec)
+            elif h.distance(sec(0.5), center) < distance:
+                roi.add(sec)
+        if bbox is not None:
+            (xlo, ylo, zlo), (xhi, yhi, zhi) = bbox
+            if any(
+                xlo <= x <= xhi and ylo <= y <= yhi and zlo <= z <= zhi
+                for x, y, z, _ in section_points(sec)
+            ):
+                roi.add(sec)
+    return roi
+
+
+def pick_3d_sections(
+    all_secs,
+    dx,
+    sections=None,
+    center=None,
+    distance=None,
+    bbox=None,
+    max_voxels=None,
+    max_bytes=None,
+    bytes_per_voxel=None,
+):
+    """return the sections to simulate in 3D
+
+    The region of interest is always included; if it alone exceeds the budget a
+    ValueError is raised. Sections adjacent to the 3D part are then added
+    greedily, cheapest first, as long as each addition reduces the number of
+    1D/3D junctions and keeps the estimated voxel count within budget.
+
+    A memory budget (max_bytes) requires bytes_per_voxel, e.g. as measured by
+    a previous run of the same model.
+    """
+    all_secs = list(all_secs)
+    if max_bytes is not None:
+        if bytes_per_voxel is None:
+            raise ValueError("bytes_per_voxel is required for a memory budget")
+        byte_limit = int(max_bytes // bytes_per_voxel)
+        max_voxels = byte_limit if max_voxels is None else min(max_voxels, byte_limit)
+
+    cost = {sec: estimate_voxels(sec, dx) for sec in all_secs}
+    secs3d = sections_in_roi(all_secs, sections=sections, center=center, distance=distance, bbox=bbox)
+    total = sum(cost[sec] for sec in secs3d)
+    if max_voxels is not None and total > max_voxels:
+        raise ValueError(
+            f"region of interest needs ~{total} voxels at dx={dx}; budget is {max_voxels}"
+        )
+
+    while True:
+        best = None
+        for sec in {other for sec in secs3d for other in neighbors(sec)} - secs3d:
+            if max_voxels is not None and total + cost[sec] > max_voxels:
+                continue
+            sec_neighbors = neighbors(sec)
+            delta = sum(1 for other in sec_neighbors if other not in secs3d) - sum(
+                1 for other in sec_neighbors if other in secs3d
+            )
+            if delta < 0 and (best is None or (delta, cost[sec]) < best[:2]):
+                best = (delta, cost[sec], sec)
+        if best is None:
+            break
+        secs3d.add(best[2])
+        total += best[1]
+
+    # preserve the original section order
+    return [sec for sec in all_secs if sec in secs3d]
+
+
+if __name__ == "__main__":
+    import sys
+
+    h.load_file("import3d.hoc")
+
+    class Cell:
+        def __init__(self, filename):
+            cell = h.Import3d_Neurolucida3()
+            cell.input(filename)
+            i3d = h.Import3d_GUI(cell, 0)
+            i3d.instantiate(self)
+
+    dx = float(sys.argv[1]) if len(sys.argv) > 1 else 0.17
+    max_voxels = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    mycell = Cell("070314F_11.ASC")
+    all_secs = list(mycell.all)
+
+    # same region of interest as Figure1A_3Dwave_time_contour.py
+    secs3d = pick_3d_sections(
+        all_secs,
+        dx,
+        sections=[mycell.apic[0], mycell.apic[1]],
+        center=mycell.soma[0](0.5),
+        distance=70,
+        max_voxels=max_voxels,
+    )
+    print(f"{len(secs3d)} of {len(all_secs)} sections in 3D")
+    print(f"estimated voxels: {sum(estimate_voxels(sec, dx) for sec in secs3d)}")
+    print(f"1D/3D junctions: {count_junctions(secs3d)}")
@@ -0,0 +1,182 @@
+"""A job queue in a shared SQLite file for splitting sweeps across machines.
+
+Every worker, on any host that can see the queue file, adds the sweep's grid
+points (adding is idempotent, so all workers can do it) and then repeatedly
+claims one pending job, runs it in a fresh process as the sweeps already do,
+and marks it done:
+
+    queue = JobQueue("queue.db", "cylinder_convergence")
+    queue.add([{"theta": theta, "phi": phi, "dx": dx} for ...])
+    queue.run_worker(run_sim)
+
+Claims are made inside a BEGIN IMMEDIATE transaction, so two workers never get
+the same job. While a job runs, its worker updates the claim's heartbeat;
+claims whose heartbeat is older than `lease` seconds (the worker died or its
+machine went away) are put back in the queue by the next claim. Workers can
+therefore be started or killed at any point in the sweep.
+
+SQLite's locking needs a filesystem with working POSIX locks; on network
+filesystems without them, keep the queue file on one machine and share it
+another way.
+
+    python job_queue.py status QUEUE_FILE   -- job counts per queue and status
+    python job_queue.py reset QUEUE_FILE    -- put failed jobs back in the queue
+"""
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+QUEUE_FILENAME = "queue.db"
+LEASE = 120
+MAX_ATTEMPTS = 3
+
+
+class JobQueue:
+    def __init__(self, filename, name, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        """filename -- the shared queue file
+        name -- the sweep; one file can hold the queues of several sweeps
+        lease -- seconds without a heartbeat before a claim expires
+        max_attempts -- claims of a job (failed or expired) before it is marked failed
+        """
+        self.filename = filename
+        self.name = name
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    queue TEXT,
+                    args TEXT,
+                    status TEXT,
+                    worker TEXT,
+                    heartbeat REAL,
+                    attempts INTEGER,
+                    error TEXT,
+                    UNIQUE (queue, args)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (queue, status)")
+
+    def _connect(self):
+        # autocommit mode so the explicit BEGIN IMMEDIATE below controls the transaction
+        return sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+
+    def add(self, jobs):
+        """add jobs (dicts of keyword arguments) that are not already queued"""
+        rows = [(self.name, json.dumps(args, sort_keys=True)) for args in jobs]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (queue, args, status, attempts) VALUES (?, ?, 'pending', 0)", rows
+            )
+            conn.execute("COMMIT")
+
+    def claim(self):
+        """claim the next pending job; returns (job_id, args), or None if none are pending"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                error = 'claim expired', worker = NULL
+                WHERE queue = ? AND status = 'claimed' AND heartbeat < ?
+                """,
+                (self.max_attempts, self.name, now - self.lease),
+            )
+            row = conn.execute(
+                "SELECT id, args FROM jobs WHERE queue = ? AND status = 'pending' ORDER BY id LIMIT 1",
+                (self.name,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'claimed', worker = ?, heartbeat = ?, attempts = attempts + 1 WHERE id = ?",
+                    (self.worker, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, job_id):
+        """extend the claim; returns False if it expired and was given to another worker"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'claimed'",
+                (time.time(), job_id, self.worker),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'done', error = NULL WHERE id = ? AND worker = ?", (job_id, self.worker))
+
+    def fail(self, job_id, error):
+        """give the job back to the queue, or mark it failed after max_attempts"""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                error = ?, worker = NULL
+                WHERE id = ? AND worker = ?
+                """,
+                (self.max_attempts, error, job_id, self.worker),
+            )
+
+    def counts(self):
+        """number of jobs in each status"""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs WHERE queue = ? GROUP BY status", (self.name,)))
+
+    def run_worker(self, target, poll=10):
+        """claim and run jobs until none are pending or claimed by other workers
+
+        Each job runs as target(**args) in its own process, so NEURON state
+        never carries over between jobs. A job fails if its process exits
+        with a nonzero exit code.
+        """
+        while True:
+            job = self.claim()
+            if job is None:
+                if self.counts().get("claimed"):
+                    # other workers are busy; their claims may still expire
+                    time.sleep(poll)
+                    continue
+                return
+            job_id, args = job
+            print(f"{self.worker} running job {job_id}: {args}")
+            p = multiprocessing.Process(target=target, kwargs=args)
+            p.start()
+            while True:
+                p.join(self.lease / 4)
+                if p.exitcode is not None:
+                    break
+                if not self.heartbeat(job_id):
+                    print(f"lost the claim on job {job_id}; stopping it")
+                    p.terminate()
+                    p.join()
+                    break
+            if p.exitcode == 0:
+                self.complete(job_id)
+            else:
+                self.fail(job_id, f"exit code {p.exitcode}")
+
+
+if __name__ == "__main__":
+    command, filename = sys.argv[1], sys.argv[2]
+    with sqlite3.connect(filename) as conn:
+        if command == "status":
+            for queue, status, count in conn.execute(
+                "SELECT queue, status, COUNT(*) FROM jobs GROUP BY queue, status ORDER BY queue, status"
+            ):
+                print(f"{queue}: {count} {status}")
+        elif command == "reset":
+            conn.execute("UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL WHERE status = 'failed'")
@@ -0,0 +1,201 @@
+import math
+import multiprocessing
+import random
+import sqlite3
+import sys
+import time
+import numpy as np
+import pandas as pd
+from neuron import h, rxd
+from neuron.units import mV, ms, um, mM
+from neuron.rxd.node import Node3D
+from thread_scaling import Cell
+from hybrid_partition import sections_in_roi
+from synapse_array import SynapseArray
+from profiling import MemoryTracker, add_missing_columns
+
+h.load_file("stdrun.hoc")
+
+DB_FILENAME = "network_scaling.db"
+NUM_RUNS = 3
+TSTOP = 20 * ms
+DT = 0.025 * ms
+
+# sections whose centers are within this path distance of the soma are 3D
+ROI_DISTANCE = 20 * um
+# somas are placed on a square lattice this far apart so their 3D grids never overlap
+CELL_SPACING = 500 * um
+
+# each cell synapses onto the next one in a ring: one chemical (ExpSyn)
+# synapse at the soma, plus calcium entry at several 3D soma surface voxels
+NUM_CA_SYNAPSES = 10
+SYNAPSE_WEIGHT = 0.1        # uS
+SYNAPSE_DELAY = 1 * ms
+CA_SYNAPSE_WEIGHT = 1e-18   # flux per event, in include_flux's default units
+CA_REST = 1e-4 * mM
+CA_DECAY = 10 * ms
+
+
+def build_network(num_cells, dx, seed=1):
+    """N copies of the thread_scaling Cell, 3D near each soma, coupled in a ring"""
+    cells = []
+    side = math.ceil(math.sqrt(num_cells))
+    for i in range(num_cells):
+        cell = Cell(dx)
+        x_offset = (i % side) * CELL_SPACING
+        y_offset = (i // side) * CELL_SPACING
+        for sec in cell.all:
+            for j in range(sec.n3d()):
+                h.pt3dchange(j, sec.x3d(j) + x_offset, sec.y3d(j) + y_offset, sec.z3d(j), sec.diam3d(j), sec=sec)
+        for sec in cell.all:
+            sec.insert(h.pas)
+        for sec in cell.soma:
+            sec.insert(h.hh)
+        cells.append(cell)
+
+    for cell in cells:
+        soma = cell.soma[0]
+        rxd.set_solve_type(list(sections_in_roi(cell.all, sections=cell.soma, center=soma(0.5), distance=ROI_DISTANCE)), dimension=3)
+
+    all_secs = [sec for cell in cells for sec in cell.all]
+    cyt = rxd.Region(all_secs, name="cyt", nrn_region="i", dx=dx)
+    ca = rxd.Species(cyt, d=0.08 * um ** 2 / ms, name="ca", charge=2, initial=CA_REST)
+    decay = rxd.Rate(ca, (CA_REST - ca) / CA_DECAY)
+
+    # ring of synapses; cell 0 is driven by a current clamp
+    rng = random.Random(seed)
+    syns, netcons = [], []
+    ca_nodes, ca_sources = [], []
+    for pre, post in zip(cells, cells[1:] + cells[:1]):
+        if pre is post:
+            break
+        pre_soma, post_soma = pre.soma[0], post.soma[0]
+        syn = h.ExpSyn(post_soma(0.5))
+        nc = h.NetCon(pre_soma(0.5)._ref_v, syn, sec=pre_soma)
+        nc.weight[0] = SYNAPSE_WEIGHT
+        nc.delay = SYNAPSE_DELAY
+        syns.append(syn)
+        netcons.append(nc)
+        surface_nodes = [node for node in ca.nodes(post_soma) if node.surface_area]
+        for node in rng.sample(surface_nodes, min(NUM_CA_SYNAPSES, len(surface_nodes))):
+            ca_nodes.append(node)
+            ca_sources.append((pre_soma(0.5)._ref_v, pre_soma))
+    ca_synapses = SynapseArray(ca_nodes, ca_sources, CA_SYNAPSE_WEIGHT, delays=SYNAPSE_DELAY) if ca_nodes else None
+    stim = h.IClamp(cells[0].soma[0](0.5))
+    stim.delay = 1 * ms
+    stim.dur = 1 * ms
+    stim.amp = 1  # nA
+
+    return {
+        "cells": cells,
+        "regions": [cyt],
+        "species": [ca],
+        "reactions": [decay],
+        "synapses": [syns, netcons, ca_synapses, stim],
+    }
+
+
+try:
+    with sqlite3.connect(DB_FILENAME) as conn:
+        old_data = pd.read_sql("SELECT * FROM data", conn)
+except:
+    old_data = pd.DataFrame({"num_cells": [], "nthread": [], "dx": []})
+
+
+def run_sim(num_cells, nthread, dx):
+    if any((old_data["num_cells"] == num_cells) & (old_data["nthread"] == nthread) & (old_data["dx"] == dx)):
+        print(f"skipping: num_cells: {num_cells}, nthread: {nthread}, dx: {dx}")
+        return
+    print(f"running: num_cells: {num_cells}, nthread: {nthread}, dx: {dx}")
+
+    memory = MemoryTracker()
+    rxd.nthread(nthread)
+    start = time.perf_counter()
+    model = build_network(num_cells, dx)
+    h.CVode().active(False)
+    h.dt = DT
+    construct_time = time.perf_counter() - start
+    # rxd does the voxelization and builds its matrices on the first initialization
+    h.finitialize(-65 * mV)
+    init_time = time.perf_counter() - start - construct_time
+    memory.end_build()
+
+    ca = model["species"][0]
+    num_3d_voxels = sum(1 for node in ca.nodes if isinstance(node, Node3D))
+    num_1d_nodes = len(ca.nodes) - num_3d_voxels
+    steps = round(TSTOP / DT)
+    runtimes = []
+    memory_records = []
+    for run in range(NUM_RUNS):
+        h.finitialize(-65 * mV)
+        start = time.perf_counter()
+        h.continuerun(TSTOP)
+        runtimes.append(time.perf_counter() - start)
+        memory.end_run()
+        memory_records.append(memory.record(len(ca.nodes)))
+        print(f"  run #{run + 1}: {runtimes[-1]} s")
+
+    data = pd.DataFrame(
+        {
+            "num_cells": num_cells,
+            "nthread": nthread,
+            "dx": dx,
+            "runcount": range(NUM_RUNS),
+            "num_3d_voxels": num_3d_voxels,
+            "num_1d_nodes": num_1d_nodes,
+            "construct_time": construct_time,
+            "init_time": init_time,
+            "build_time": construct_time + init_time,
+            "runtime": runtimes,
+            "step_time": [runtime / steps for runtime in runtimes],
+            **{column: [record[column] for record in memory_records] for column in MemoryTracker.COLUMNS}
+        }
+    )
+    with sqlite3.connect(DB_FILENAME) as conn:
+        add_missing_columns(conn, "data", list(data.columns))
+        data.to_sql("data", conn, if_exists="append", index=False)
+
+
+def analyze():
+    """how build time, memory and step time grow with the number of cells"""
+    with sqlite3.connect(DB_FILENAME) as conn:
+        data = pd.read_sql("SELECT * FROM data", conn)
+    data["build_memory"] = data["build_peak_rss"] - data["baseline_rss"]
+    data = data.groupby(["dx", "nthread", "num_cells"]).agg(
+        {"build_time": "min", "step_time": "min", "build_memory": "max", "run_peak_rss": "max", "num_3d_voxels": "first"}
+    ).reset_index()
+    for (dx, nthread), group in data.groupby(["dx", "nthread"]):
+        print(f"dx={dx}, nthread={nthread}:")
+        print(group.drop(columns=["dx", "nthread"]).to_string(index=False))
+        if len(group) < 2:
+            continue
+        # cost ~ num_cells ** exponent; 1 is linear in the population size
+        log_n = np.log(group["num_cells"])
+        for column in ["build_time", "build_memory", "step_time"]:
+            exponent, _ = np.polyfit(log_n, np.log(group[column]), 1)
+            print(f"    {column} ~ N^{exponent:.2f}")
+        largest = group.iloc[-1]
+        print(f"    per cell at N={largest['num_cells']:.0f}: "
+              f"build {largest['build_time'] / largest['num_cells']:.3f} s, "
+              f"{largest['build_memory'] / largest['num_cells'] / 2 ** 20:.1f} MiB, "
+              f"step {1e6 * largest['step_time'] / largest['num_cells']:.1f} µs")
+
+    step_time = data.set_index(["dx", "num_cells", "nthread"])["step_time"].unstack("nthread")
+    if 1 in step_time.columns:
+        print("step time speedup over nthread=1:")
+        print(step_time.rdiv(step_time[1], axis=0).to_string())
+
+
+if __name__ == "__main__":
+    # python network_scaling.py [dx]   -- run the (num_cells, nthread) grid, then analyze
+    # python network_scaling.py analyze
+    if len(sys.argv) > 1 and sys.argv[1] == "analyze":
+        analyze()
+        sys.exit()
+    dx = float(sys.argv[1]) if len(sys.argv) > 1 else 0.25
+    for num_cells in [1, 2, 4, 8, 16, 32, 64]:
+        for nthread in [1, 2, 4, 8]:
+            p = multiprocessing.Process(target=run_sim, args=(num_cells, nthread, dx))
+            p.start()
+            p.join()
+    analyze()
@@ -1,29 +1,132 @@
 import sqlite3
+import sys
+import numpy as np
 import pandas as pd
 import plotnine as p9
 
 DB_FILENAME = "thread_scaling.db"
 
-with sqlite3.connect(DB_FILENAME) as conn:
-    data = pd.read_sql("""
-        SELECT nthread, morphology, kinetics, dx, MIN(runtime)
-        FROM data
-        GROUP BY nthread, morphology, kinetics, dx
-    """, conn)
-
-data["dx"] = data["dx"].astype("category")
-data["Model"] = [f"{morph} {kinetics}" for morph, kinetics in zip(data["morphology"], data["kinetics"])]
-
-print(
-    data[data["Model"] == "cell cawave"]
-)
-
-print(
-    p9.ggplot(data, p9.aes(x="nthread", y="MIN(runtime)", color="Model", linetype="dx"))
-    + p9.geom_line(size=1.2)
-    + p9.geom_point()
-    + p9.scale_x_continuous(trans="log2")
-    + p9.scale_y_continuous(trans="log10")
-    + p9.theme(subplots_adjust={'right': 0.7})
-    + p9.labs(x="Number of threads", y="Minimum simulation time (s)")
-)
\ No newline at end of file
+# thread counts whose parallel efficiency falls below this are flagged
+EFFICIENCY_THRESHOLD = 0.7
+NUM_BOOTSTRAP = 1000
+
+
+def scaling_stats(nthreads, runtimes):
+    """speedup at each thread count, and the Amdahl and Gustafson serial fractions
+
+    nthreads -- sorted thread counts, starting at 1
+    runtimes -- {nthread: array of the repeated runs' times}
+    """
+    best = np.array([runtimes[n].min() for n in nthreads])
+    speedup = best[0] / best
+    # Amdahl: T(n) = T1 * (s + (1 - s) / n) = a + b / n, fit to every run
+    n_all = np.concatenate([np.full(len(runtimes[n]), n) for n in nthreads])
+    t_all = np.concatenate([runtimes[n] for n in nthreads])
+    (a, b), *_ = np.linalg.lstsq(np.column_stack([np.ones(len(n_all)), 1 / n_all]), t_all, rcond=None)
+    amdahl = np.clip(a / (a + b), 0, 1)
+    # Gustafson: S(n) = n - s * (n - 1)
+    gustafson = np.sum((nthreads - speedup) * (nthreads - 1)) / np.sum((nthreads - 1) ** 2)
+    return speedup, amdahl, gustafson
+
+
+def scaling_analysis(runs, threshold=EFFICIENCY_THRESHOLD, num_bootstrap=NUM_BOOTSTRAP, seed=1):
+    """per thread count and per model: speedup, efficiency, serial fractions, with 95% bootstrap intervals
+
+    The intervals come from resampling the repeated runs at each thread count.
+    The recommended nthread is the largest count before efficiency first
+    drops below threshold.
+    """
+    rng = np.random.default_rng(seed)
+    per_thread = []
+    per_model = []
+    for (morphology, kinetics, dx), group in runs.groupby(["morphology", "kinetics", "dx"]):
+        runtimes = {n: g["runtime"].to_numpy() for n, g in group.groupby("nthread")}
+        if 1 not in runtimes or len(runtimes) < 2:
+            continue
+        nthreads = np.array(sorted(runtimes))
+        speedup, amdahl, gustafson = scaling_stats(nthreads, runtimes)
+        boot = [
+            scaling_stats(nthreads, {n: rng.choice(t, len(t)) for n, t in runtimes.items()})
+            for _ in range(num_bootstrap)
+        ]
+        speedup_low, speedup_high = np.percentile([b[0] for b in boot], [2.5, 97.5], axis=0)
+        amdahl_low, amdahl_high = np.percentile([b[1] for b in boot], [2.5, 97.5])
+        gustafson_low, gustafson_high = np.percentile([b[2] for b in boot], [2.5, 97.5])
+
+        efficiency = speedup / nthreads
+        below = nthreads[efficiency < threshold]
+        first_below = below.min() if len(below) else None
+        recommended = nthreads[nthreads < first_below].max() if first_below is not None else nthreads.max()
+        num_voxels = group["num_voxels"].max() if "num_voxels" in group else None
+
+        for i, n in enumerate(nthreads):
+            per_thread.append({
+                "morphology": morphology, "kinetics": kinetics, "dx": dx, "nthread": n,
+                "speedup": speedup[i], "speedup_low": speedup_low[i], "speedup_high": speedup_high[i],
+                "efficiency": efficiency[i], "efficiency_low": speedup_low[i] / n, "efficiency_high": speedup_high[i] / n,
+            })
+        per_model.append({
+            "morphology": morphology, "kinetics": kinetics, "dx": dx, "num_voxels": num_voxels,
+            "amdahl_serial_fraction": amdahl, "amdahl_low": amdahl_low, "amdahl_high": amdahl_high,
+            "gustafson_serial_fraction": gustafson, "gustafson_low": gustafson_low, "gustafson_high": gustafson_high,
+            "efficiency_threshold": threshold, "first_nthread_below_threshold": first_below,
+            "recommended_nthread": recommended,
+        })
+    return pd.DataFrame(per_thread), pd.DataFrame(per_model)
+
+
+if __name__ == "__main__":
+    # python plot_thread_scaling.py [efficiency_threshold]
+    threshold = float(sys.argv[1]) if len(sys.argv) > 1 else EFFICIENCY_THRESHOLD
+
+    with sqlite3.connect(DB_FILENAME) as conn:
+        data = pd.read_sql("""
+            SELECT nthread, morphology, kinetics, dx, MIN(runtime)
+            FROM data
+            GROUP BY nthread, morphology, kinetics, dx
+        """, conn)
+        runs = pd.read_sql("SELECT * FROM data", conn)
+
+    per_thread, per_model = scaling_analysis(runs, threshold)
+    # stored next to the data so job scripts can look up the nthread to use for a model size
+    with sqlite3.connect(DB_FILENAME) as conn:
+        per_thread.to_sql("scaling", conn, if_exists="replace", index=False)
+        per_model.to_sql("scaling_summary", conn, if_exists="replace", index=False)
+
+    for row in per_model.itertuples():
+        print(
+            f"{row.morphology} {row.kinetics} dx={row.dx}: "
+            f"Amdahl serial fraction {row.amdahl_serial_fraction:.3f} [{row.amdahl_low:.3f}, {row.amdahl_high:.3f}], "
+            f"Gustafson {row.gustafson_serial_fraction:.3f} [{row.gustafson_low:.3f}, {row.gustafson_high:.3f}]; "
+            f"efficiency < {threshold} from nthread={row.first_nthread_below_threshold}, use nthread={row.recommended_nthread}"
+        )
+
+    data["dx"] = data["dx"].astype("category")
+    data["Model"] = [f"{morph} {kinetics}" for morph, kinetics in zip(data["morphology"], data["kinetics"])]
+
+    print(
+        data[data["Model"] == "cell cawave"]
+    )
+
+    print(
+        p9.ggplot(data, p9.aes(x="nthread", y="MIN(runtime)", color="Model", linetype="dx"))
+        + p9.geom_line(size=1.2)
+        + p9.geom_point()
+        + p9.scale_x_continuous(trans="log2")
+        + p9.scale_y_continuous(trans="log10")
+        + p9.theme(subplots_adjust={'right': 0.7})
+        + p9.labs(x="Number of threads", y="Minimum simulation time (s)")
+    )
+
+    per_thread["dx"] = per_thread["dx"].astype("category")
+    per_thread["Model"] = [f"{morph} {kinetics}" for morph, kinetics in zip(per_thread["morphology"], per_thread["kinetics"])]
+    print(
+        p9.ggplot(per_thread, p9.aes(x="nthread", y="efficiency", color="Model", linetype="dx"))
+        + p9.geom_line(size=1.2)
+        + p9.geom_point()
+        + p9.geom_errorbar(p9.aes(ymin="efficiency_low", ymax="efficiency_high"), width=0.1)
+        + p9.geom_hline(yintercept=threshold, linetype="dashed")
+        + p9.scale_x_continuous(trans="log2")
+        + p9.theme(subplots_adjust={'right': 0.7})
+        + p9.labs(x="Number of threads", y="Parallel efficiency")
+    )
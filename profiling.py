@@ -0,0 +1,272 @@
+"""Wall time and memory instrumentation for the benchmark scripts.
+
+MemoryTracker records baseline, post-build and peak resident memory for one
+benchmark record, and derived bytes per voxel.
+
+PhaseTimer breaks rxd's 3D discretization (normally timed as a single call to
+rxd.re_init()) into phases by temporarily wrapping the NEURON internals that
+implement each phase. Internal names differ between NEURON versions, so each
+phase lists candidate hook points; phases whose hooks are not found are
+reported with a wall time of None rather than failing the run.
+"""
+import importlib
+import resource
+import time
+
+
+# phase name -> candidate (module, attribute) hook points, searched in order.
+# Attributes are patched in the *calling* module's namespace, which is where
+# python-level calls look them up. "Class.method" patches a method, and
+# "object.attribute" an attribute of a module-level object.
+#
+# In NEURON 8.2 and 9.0, Region._do_init calls its geometry's volumes3d, which
+# for rxd.inside is FullJoinMorph.fullmorph bound at import time (other
+# geometries call it as geometry3d.voxelize2). fullmorph builds the
+# constructive geometry, sets up the grid, classifies voxels with
+# GeneralizedVoxelization.voxelize, and refines surface voxels with
+# simplevolume and surface_area, all looked up in FullJoinMorph's namespace.
+# What is left of fullmorph (grid setup, and assigning voxels to segments) is
+# "grid_setup"; what is left of Region._do_init (section sorting and building
+# the per-segment node lists from the voxels) is "region_setup".
+#
+# Each species then creates its Node3D objects in Species._do_init3
+# ("species_nodes"), and one _IntracellularSpecies per 3D region, whose
+# __init__ builds the neighbor array and the ADI line definitions and hands
+# them to the C solver: that is the 3D "diffusion_matrix". _setup_matrices
+# only assembles the 1D matrix, which is quick for a fully 3D model.
+DISCRETIZATION_PHASES = {
+    "constructive_geometry": [
+        ("neuron.rxd.geometry3d.FullJoinMorph", "constructive_neuronal_geometry"),
+    ],
+    "grid_setup": [
+        ("neuron.rxd.geometry", "inside.volumes3d"),
+        ("neuron.rxd.geometry3d", "voxelize2"),
+    ],
+    "inside_outside": [
+        ("neuron.rxd.geometry3d.FullJoinMorph", "voxelize"),
+    ],
+    "partial_volume": [
+        ("neuron.rxd.geometry3d.FullJoinMorph", "simplevolume"),
+    ],
+    "surface_area": [
+        ("neuron.rxd.geometry3d.FullJoinMorph", "surface_area"),
+    ],
+    "region_setup": [
+        ("neuron.rxd.region", "Region._do_init"),
+    ],
+    "species_nodes": [
+        ("neuron.rxd.species", "Species._do_init3"),
+    ],
+    "diffusion_matrix": [
+        ("neuron.rxd.species", "_IntracellularSpecies.__init__"),
+        ("neuron.rxd.rxd", "_setup_matrices"),
+    ],
+}
+
+
+def peak_rss():
+    """peak resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss():
+    """current resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return peak_rss()
+
+
+def reset_peak_rss():
+    """reset the peak RSS counter so the next peak_rss() covers only what follows
+
+    Only possible on Linux; elsewhere the peak remains the process-wide peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class PhaseTimer:
+    """accumulate exclusive wall time and peak RSS for named phases
+
+    Usage:
+        timer = PhaseTimer(DISCRETIZATION_PHASES)
+        with timer:
+            rxd.re_init()
+        timer.results  # {phase: {"wall_time": ..., "peak_rss": ...}}
+
+    Time spent in a nested phase is subtracted from the enclosing phase, so the
+    wall times add up to (at most) the total time.
+    """
+
+    def __init__(self, phases):
+        self.phases = phases
+        self.results = {}
+        self._patches = []
+        self._stack = []
+
+    def _resolve(self, module_name, attr):
+        try:
+            owner = importlib.import_module(module_name)
+        except ImportError:
+            return None
+        *path, name = attr.split(".")
+        for part in path:
+            owner = getattr(owner, part, None)
+            if owner is None:
+                return None
+        if not callable(getattr(owner, name, None)):
+            return None
+        return owner, name
+
+    def _wrap(self, phase, func):
+        def wrapper(*args, **kwargs):
+            # the peak counter is reset at the start of each phase; the enclosing
+            # phase keeps the peak seen so far in its stack entry
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], peak_rss())
+            reset_peak_rss()
+            self._stack.append([time.perf_counter(), 0, 0])
+            try:
+                return func(*args, **kwargs)
+            finally:
+                start, child_time, carried_peak = self._stack.pop()
+                elapsed = time.perf_counter() - start
+                phase_peak = max(peak_rss(), carried_peak)
+                if self._stack:
+                    self._stack[-1][1] += elapsed
+                    self._stack[-1][2] = max(self._stack[-1][2], phase_peak)
+                result = self.results[phase]
+                result["wall_time"] = (result["wall_time"] or 0) + elapsed - child_time
+                result["peak_rss"] = max(result["peak_rss"] or 0, phase_peak)
+
+        return wrapper
+
+    def __enter__(self):
+        missing = []
+        for phase, candidates in self.phases.items():
+            self.results[phase] = {"wall_time": None, "peak_rss": None}
+            found = False
+            for module_name, attr in candidates:
+                target = self._resolve(module_name, attr)
+                if target is not None:
+                    owner, name = target
+                    original = getattr(owner, name)
+                    setattr(owner, name, self._wrap(phase, original))
+                    self._patches.append((owner, name, original))
+                    found = True
+            if not found:
+                missing.append(phase)
+        if missing:
+            print(f"PhaseTimer: no hook points found for {', '.join(missing)}")
+        return self
+
+    def __exit__(self, *args):
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches = []
+        return False
+
+
+class MemoryTracker:
+    """memory use of one benchmark record, split into a build and a run phase
+
+    Create the tracker before constructing the model (its RSS at that point is
+    the baseline), call end_build() once the model is built and initialized,
+    and end_run() after each simulation. record() gives the columns stored in
+    the benchmark tables; bytes per voxel are relative to the baseline so they
+    exclude the interpreter and NEURON itself.
+    """
+
+    COLUMNS = [
+        "baseline_rss",
+        "build_rss",
+        "build_peak_rss",
+        "run_peak_rss",
+        "build_bytes_per_voxel",
+        "run_bytes_per_voxel",
+    ]
+
+    def __init__(self):
+        reset_peak_rss()
+        self.baseline_rss = current_rss()
+        self.build_rss = None
+        self.build_peak_rss = None
+        self.run_peak_rss = None
+
+    def end_build(self, peak=None):
+        """peak: an already-measured peak to include (e.g. from a PhaseTimer,
+        which resets the peak counter as it goes)"""
+        self.build_rss = current_rss()
+        self.build_peak_rss = max(peak_rss(), peak or 0)
+        reset_peak_rss()
+
+    def end_run(self):
+        self.run_peak_rss = max(peak_rss(), self.run_peak_rss or 0)
+
+    def record(self, num_voxels):
+        def per_voxel(rss):
+            if rss is None or not num_voxels:
+                return None
+            return (rss - self.baseline_rss) / num_voxels
+
+        return {
+            "baseline_rss": self.baseline_rss,
+            "build_rss": self.build_rss,
+            "build_peak_rss": self.build_peak_rss,
+            "run_peak_rss": self.run_peak_rss,
+            "build_bytes_per_voxel": per_voxel(self.build_peak_rss),
+            "run_bytes_per_voxel": per_voxel(self.run_peak_rss),
+        }
+
+
+def add_missing_columns(conn, table, columns):
+    """add columns to an existing table so rows from older runs can stay in place"""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if not existing:
+        # the table does not exist yet; it will be created with all the columns
+        return
+    for column in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+
+
+def _sql_type(values):
+    for value in values:
+        if isinstance(value, (bool, int)):
+            return "INTEGER"
+        if isinstance(value, float):
+            return "REAL"
+        if value is not None:
+            return "TEXT"
+    return ""
+
+
+def insert_rows(conn, table, rows):
+    """append rows (dicts with the same keys) to table, creating it or adding columns as needed
+
+    This does what DataFrame.to_sql(table, conn, if_exists="append") does for
+    the benchmark tables, without importing pandas in short-lived workers.
+    """
+    columns = list(rows[0])
+    definitions = ", ".join(f'"{column}" {_sql_type(row[column] for row in rows)}' for column in columns)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definitions})")
+    add_missing_columns(conn, table, columns)
+    names = ", ".join(f'"{column}"' for column in columns)
+    conn.executemany(
+        f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))})",
+        [tuple(row[column] for column in columns) for row in rows],
+    )
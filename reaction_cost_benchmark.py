@@ -0,0 +1,128 @@
+import itertools
+import multiprocessing
+import sqlite3
+import sys
+import time
+import numpy as np
+import pandas as pd
+from neuron import h, rxd
+from neuron.units import mV, ms
+from thread_scaling import Cylinder, Cell
+from synthetic_kinetics import synthetic
+
+DB_FILENAME = "reaction_cost.db"
+TSTOP = 10 * ms
+DT = 0.025 * ms
+
+NUM_SPECIES = [1, 2, 4, 8]
+NUM_REACTIONS_PER_SPECIES = [1, 2]
+COMPLEXITIES = [1, 2, 4]
+
+# model to predict the cost of: (species, reactions, terms per reaction)
+PRODUCTION_MODEL = (20, 30, 3)
+
+
+def run_sim(morphology, num_species, num_reactions, complexity, variant, dx, nthread=1):
+    """time one variant: "diffusion" (no reactions), "reaction" (d = 0) or "full" """
+    h.load_file("stdrun.hoc")
+    rxd.nthread(nthread)
+    rxd.set_solve_type(dimension=3)
+    morph = morphology(dx)
+    if variant == "diffusion":
+        kinetics = synthetic(num_species, 0)
+    elif variant == "reaction":
+        kinetics = synthetic(num_species, num_reactions, complexity, d=0)
+    else:
+        kinetics = synthetic(num_species, num_reactions, complexity)
+    my_kinetics = kinetics(morph)
+
+    h.CVode().active(False)
+    h.dt = DT
+    h.finitialize(-65 * mV)
+    start = time.perf_counter()
+    h.continuerun(TSTOP)
+    runtime = time.perf_counter() - start
+
+    num_voxels = len(my_kinetics["species"][0].nodes)
+    steps = round(TSTOP / DT)
+    data = pd.DataFrame(
+        {
+            "morphology": [morph.name],
+            "dx": [dx],
+            "nthread": [nthread],
+            "variant": [variant],
+            "num_species": [num_species],
+            "num_reactions": [num_reactions if variant != "diffusion" else 0],
+            "complexity": [complexity if variant != "diffusion" else 0],
+            "num_voxels": [num_voxels],
+            "steps": [steps],
+            "runtime": [runtime],
+            "cost_per_voxel_step": [runtime / (num_voxels * steps)],
+        }
+    )
+    print(data.to_string(index=False, header=False))
+    with sqlite3.connect(DB_FILENAME) as conn:
+        data.to_sql("data", conn, if_exists="append", index=False)
+
+
+def analyze():
+    """fit per-voxel-step costs and predict PRODUCTION_MODEL"""
+    with sqlite3.connect(DB_FILENAME) as conn:
+        data = pd.read_sql("SELECT * FROM data", conn)
+    for (morphology, dx), group in data.groupby(["morphology", "dx"]):
+        # the diffusion-only and reaction-only runs both pay the fixed per-step
+        # cost, so fit them together with one intercept for it:
+        # cost = overhead + per_diffusing_species * N (diffusion runs)
+        #                 + per_species * N + per_term * M * C (reaction runs)
+        fitted = group[group["variant"].isin(["diffusion", "reaction"])]
+        diffuses = (fitted["variant"] == "diffusion").to_numpy()
+        reacts = ~diffuses
+        design = np.column_stack([
+            np.ones(len(fitted)),
+            fitted["num_species"] * diffuses,
+            fitted["num_species"] * reacts,
+            fitted["num_reactions"] * fitted["complexity"] * reacts,
+        ])
+        (overhead, diffusion_per_species, per_species, per_term), *_ = np.linalg.lstsq(
+            design, fitted["cost_per_voxel_step"], rcond=None
+        )
+
+        def predict(num_species, num_reactions, complexity):
+            return overhead + (diffusion_per_species + per_species) * num_species + per_term * num_reactions * complexity
+
+        n, m, c = PRODUCTION_MODEL
+        print(f"{morphology}, dx={dx}:")
+        print(f"    diffusion: {diffusion_per_species:.3e} s per species per voxel-step")
+        print(f"    reactions: {per_term:.3e} s per term per voxel-step, {per_species:.3e} s per species")
+        print(f"    fixed: {overhead:.3e} s per voxel-step")
+        print(f"    predicted for {n} species, {m} reactions x {c} terms: "
+              f"diffusion {diffusion_per_species * n:.3e}, reactions {per_species * n + per_term * m * c:.3e}, "
+              f"total {predict(n, m, c):.3e} s per voxel-step")
+
+        full = group[group["variant"] == "full"]
+        if len(full):
+            predicted = predict(full["num_species"], full["num_reactions"], full["complexity"])
+            error = np.abs(predicted - full["cost_per_voxel_step"]) / full["cost_per_voxel_step"]
+            print(f"    diffusion + reaction prediction of the full runs: median relative error {100 * np.median(error):.1f}%")
+
+if __name__ == "__main__":
+    # python reaction_cost_benchmark.py [dx]   -- run the grid, then analyze
+    # python reaction_cost_benchmark.py analyze
+    if len(sys.argv) > 1 and sys.argv[1] == "analyze":
+        analyze()
+        sys.exit()
+    dx = float(sys.argv[1]) if len(sys.argv) > 1 else 0.12
+    for morphology in [Cylinder, Cell]:
+        for num_species, per_species, complexity in itertools.product(NUM_SPECIES, NUM_REACTIONS_PER_SPECIES, COMPLEXITIES):
+            num_reactions = num_species * per_species
+            variants = ["reaction", "full"]
+            if per_species == NUM_REACTIONS_PER_SPECIES[0] and complexity == COMPLEXITIES[0]:
+                # diffusion cost does not depend on the reactions; measure it once per num_species
+                variants.insert(0, "diffusion")
+            for variant in variants:
+                p = multiprocessing.Process(
+                    target=run_sim, args=(morphology, num_species, num_reactions, complexity, variant, dx)
+                )
+                p.start()
+                p.join()
+    analyze()
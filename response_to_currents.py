@@ -1,13 +1,26 @@
 from neuron import h, rxd
 from neuron.units import mV, ms
 import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import sqlite3
+import sys
 
 h.load_file("stdrun.hoc")
 import time
 import multiprocessing
 
 
-def run_sim(tstop, dim, d):
+DB_FILENAME = "response_to_currents.db"
+
+# benchmark grid; the smallest dx is the reference for each D
+BENCHMARK_DS = [1e-4, 1e-3, 1e-2, 1e-1, 1]
+BENCHMARK_DXS = [0.5, 0.25, 0.125]
+# 3D "matters" while it moves the membrane potential by more than this
+V_TOLERANCE = 1 * mV
+
+
+def run_sim(tstop, dim, d, dx=0.25):
     start = time.perf_counter()
 
     soma = h.Section(name="soma")
@@ -17,7 +30,7 @@ def run_sim(tstop, dim, d):
     soma.insert(h.hh)
 
     rxd.set_solve_type(dimension=dim)
-    cyt = rxd.Region([soma], nrn_region="i", name="cyt")
+    cyt = rxd.Region([soma], nrn_region="i", name="cyt", dx=dx)
     na = rxd.Species(cyt, name="na", charge=1, initial=h.nai0_na_ion, d=d)
 
     ic = h.IClamp(soma(0.5))
@@ -30,11 +43,14 @@ def run_sim(tstop, dim, d):
     sodium = h.Vector().record(soma(0.5)._ref_nai)
 
     h.finitialize(-65 * mV)
+    run_start = time.perf_counter()
     h.continuerun(tstop)
 
     finished = time.perf_counter()
     return {
         "time": finished - start,
+        "run_time": finished - run_start,
+        "dx": dx,
         "num_nodes": len(na.nodes),
         "total_na": sum(node.volume * node.concentration for node in na.nodes),
         "surface_area": sum(node.surface_area for node in na.nodes),
@@ -57,19 +73,22 @@ def main():
     sodium_axis = fig.add_subplot(2, 1, 2)
     sodium_axis_zoom = sodium_axis.inset_axes([0.01, 0.38, 0.3, 0.6])
 
-    pool = multiprocessing.Pool()
-
-    for data in pool.starmap(
-        run_sim,
-        [
-            [tstop, 3, 1e-4],
-            [tstop, 3, 1e-3],
-            [tstop, 3, 1e-2],
-            [tstop, 3, 1e-1],
-            [tstop, 3, 1],
-            [tstop, 1, 0],
-        ],
-    ):
+    # rxd cannot be reset within a process, so each run gets a fresh worker
+    with multiprocessing.Pool(maxtasksperchild=1) as pool:
+        results = pool.starmap(
+            run_sim,
+            [
+                [tstop, 3, 1e-4],
+                [tstop, 3, 1e-3],
+                [tstop, 3, 1e-2],
+                [tstop, 3, 1e-1],
+                [tstop, 3, 1],
+                [tstop, 1, 0],
+            ],
+            chunksize=1,
+        )
+
+    for data in results:
         if data["dimension"] == 3:
             for axis in [voltage_axis, voltage_axis_zoom]:
                 axis.plot(data["t"], data["v"], label=f"D={data['na_d']}")
@@ -126,5 +145,58 @@ elapsed time = {data["time"]}
     plt.show()
 
 
+def benchmark():
+    """cost and accuracy of 3D (each D and dx) and 1D against the finest 3D grid"""
+    tstop = 100 * ms
+    configs = [[tstop, 3, d, dx] for d in BENCHMARK_DS for dx in BENCHMARK_DXS] + [[tstop, 1, 0, 0.25]]
+    # one run per worker process; a second run_sim in a process fails in rxd
+    with multiprocessing.Pool(maxtasksperchild=1) as pool:
+        results = pool.starmap(run_sim, configs, chunksize=1)
+
+    reference_dx = min(BENCHMARK_DXS)
+    references = {
+        data["na_d"]: np.array(data["v"]) for data in results
+        if data["dimension"] == 3 and data["dx"] == reference_dx
+    }
+    one_d = [data for data in results if data["dimension"] == 1][0]
+
+    rows = []
+    for data in results:
+        v = np.array(data["v"])
+        if data["dimension"] == 3:
+            v_error = np.max(np.abs(v - references[data["na_d"]]))
+            v_1d_difference = np.max(np.abs(np.array(one_d["v"]) - references[data["na_d"]]))
+        else:
+            v_error = v_1d_difference = None
+        rows.append(
+            {
+                "dimension": data["dimension"],
+                "d": data["na_d"],
+                "dx": data["dx"] if data["dimension"] == 3 else None,
+                "num_voxels": data["num_nodes"],
+                "time_per_ms": data["run_time"] / tstop,
+                "total_time": data["time"],
+                "v_error": v_error,
+                "v_1d_difference": v_1d_difference,
+            }
+        )
+    data = pd.DataFrame(rows)
+    with sqlite3.connect(DB_FILENAME) as conn:
+        data.to_sql("data", conn, if_exists="append", index=False)
+    print(data.to_string())
+
+    # 1D vs the reference 3D response, by diffusion constant
+    differences = data[(data["dimension"] == 3) & (data["dx"] == reference_dx)].sort_values("d")
+    matters = differences[differences["v_1d_difference"] > V_TOLERANCE]
+    break_even = differences[differences["d"] > matters["d"].max()] if len(matters) else differences
+    if len(break_even):
+        print(f"3D changes the membrane potential by less than {V_TOLERANCE} mV for D >= {break_even['d'].min()} µm^2/ms; 1D suffices there")
+    else:
+        print(f"3D changes the membrane potential by more than {V_TOLERANCE} mV for every D tested")
+
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+    else:
+        main()
@@ -4,6 +4,7 @@ import plotly.graph_objects as go
 import numpy as np
 import plotnine as p9
 import pandas as pd
+from voxel_index import VoxelIndex
 
 h.load_file("stdrun.hoc")
 
@@ -21,7 +22,10 @@ assert len(my_nodes) == 1
 my_node = my_nodes[0]
 assert my_node.surface_area > 0
 
-nearby_nodes = [c.nodes((my_node.x3d + dx, my_node.y3d, my_node.z3d))[0] for dx in [0.1, 0.5, 1, 2]]
+index = VoxelIndex(c)
+nearby_nodes = index.nearest_nodes(
+    [(my_node.x3d + dx, my_node.y3d, my_node.z3d) for dx in [0.1, 0.5, 1, 2]]
+)
 
 r = h.RxDSyn(my_node.segment)
 my_node.include_flux(r._ref_g)
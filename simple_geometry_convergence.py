@@ -3,20 +3,22 @@ from neuron import h, rxd
 import multiprocessing
 import numpy as np
 import sqlite3
-import tqdm
-import pandas as pd
+import sys
+from profiling import MemoryTracker, insert_rows
 
 DB_FILENAME = "simple_geometry_convergence.db"
 
+# (dx, resolution) already in the database; read without pandas to keep workers light
 try:
     with sqlite3.connect(DB_FILENAME) as conn:
-        old_data = pd.read_sql("SELECT * FROM data", conn)
-except:
-    old_data = pd.DataFrame({"dx": [], "resolution": []})
+        done = set(conn.execute("SELECT dx, resolution FROM data"))
+except sqlite3.OperationalError:
+    done = set()
 
 
 def run_sim(dx, res=2, L=20, diam=2):
     start = time.perf_counter()
+    memory = MemoryTracker()
 
     rxd.options.ics_partial_volume_resolution = res
 
@@ -27,35 +29,59 @@ def run_sim(dx, res=2, L=20, diam=2):
 
     cyt = rxd.Region([dend], name="cyt", dx=dx)
     ca = rxd.Species(cyt, name="ca", charge=2)
+    rxd.re_init()
+    memory.end_build()
+    num_voxels = len(ca.nodes)
 
     true_volume = h.PI * dend.diam ** 2 * 0.25 * dend.L
     true_area = h.PI * dend.diam * dend.L + 0.5 * h.PI * dend.diam ** 2
 
-    data = pd.DataFrame(
-        {
-            "dx": [dx],
-            "L": L,
-            "diam": diam,
-            "surface_area": sum(ca.nodes.surface_area),
-            "volume": sum(ca.nodes.volume),
-            "surface_area_relative_error": 1 - sum(ca.nodes.surface_area) / true_area,
-            "volume_relative_error": 1 - sum(ca.nodes.volume) / true_volume,
-            "runtime": time.perf_counter() - start,
-            "resolution": res
-        }
-    )
+    row = {
+        "dx": float(dx),
+        "L": L,
+        "diam": diam,
+        "surface_area": sum(ca.nodes.surface_area),
+        "volume": sum(ca.nodes.volume),
+        "surface_area_relative_error": 1 - sum(ca.nodes.surface_area) / true_area,
+        "volume_relative_error": 1 - sum(ca.nodes.volume) / true_volume,
+        "runtime": time.perf_counter() - start,
+        "resolution": res,
+        "num_voxels": num_voxels,
+        **memory.record(num_voxels),
+    }
     with sqlite3.connect(DB_FILENAME) as conn:
-        data.to_sql("data", conn, if_exists="append", index=False)
-
+        insert_rows(conn, "data", [row])
 
 
 if __name__ == "__main__":
-    for dx in tqdm.tqdm(np.logspace(np.log10(0.5), -2)):
-        for res in [10, 8, 6, 4, 2]:
-            if any((old_data["dx"] == dx) & (old_data["resolution"] == res)):
+    dxs = np.logspace(np.log10(0.5), -2)
+    resolutions = [10, 8, 6, 4, 2]
+
+    def already_done(dx, res):
+        return (dx, res) in done
+
+    if len(sys.argv) > 1 and sys.argv[1] == "queue":
+        # python simple_geometry_convergence.py queue [queue_file]
+        # run on as many machines as wanted; each claims (dx, resolution) jobs from the shared queue
+        from job_queue import JobQueue, QUEUE_FILENAME
+
+        queue = JobQueue(sys.argv[2] if len(sys.argv) > 2 else QUEUE_FILENAME, "simple_geometry_convergence")
+        queue.add(
+            {"dx": float(dx), "res": res}
+            for dx in dxs
+            for res in resolutions
+            if not already_done(dx, res)
+        )
+        queue.run_worker(run_sim)
+        sys.exit()
+
+    import tqdm
+
+    for dx in tqdm.tqdm(dxs):
+        for res in resolutions:
+            if already_done(dx, res):
                 continue
             else:
                 p = multiprocessing.Process(target=run_sim, args=(dx, res))
                 p.start()
                 p.join()
-    
\ No newline at end of file
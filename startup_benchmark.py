@@ -0,0 +1,68 @@
+"""Time how long a fresh worker process takes to start.
+
+Sweeps launch thousands of short processes, so the cost of importing a
+script's module (and whatever it imports and loads at import time) is paid
+once per job. For each module this starts a new interpreter that imports it,
+several times, and reports the median import time and which of the heavy
+analysis and plotting libraries ended up loaded. Baselines for the
+interpreter alone, NEURON, and those libraries are included for comparison.
+
+    python startup_benchmark.py [module ...]
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+NUM_REPEATS = 5
+HEAVY_MODULES = ["pandas", "matplotlib", "plotnine", "plotly", "scipy", "tqdm"]
+BASELINES = ["", "neuron", "pandas", "matplotlib.pyplot", "plotnine"]
+WORKERS = [
+    "time_discretization",
+    "cylinder_convergence",
+    "conservation_tests",
+    "simple_geometry_convergence",
+    "wave_time_3d",
+    "thread_scaling",
+]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+
+def time_import(module):
+    """median import and whole-process times of module in a fresh interpreter,
+    and the heavy modules it loaded"""
+    statement = f"import {module}" if module else "pass"
+    import_times = []
+    process_times = []
+    for _ in range(NUM_REPEATS):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+            capture_output=True,
+            text=True,
+        )
+        process_times.append(time.perf_counter() - start)
+        if result.returncode:
+            return None, None, result.stderr.strip().splitlines()[-1]
+        elapsed, heavy = result.stdout.splitlines()[-1].split(" ")
+        import_times.append(float(elapsed))
+    return statistics.median(import_times), statistics.median(process_times), heavy or "-"
+
+
+if __name__ == "__main__":
+    modules = sys.argv[1:] or BASELINES + WORKERS
+    print(f"{'module':30s} {'import (s)':>10s} {'process (s)':>11s}  heavy modules loaded")
+    for module in modules:
+        import_time, process_time, heavy = time_import(module)
+        if import_time is None:
+            print(f"{module or '(interpreter)':30s} failed: {heavy}")
+        else:
+            print(f"{module or '(interpreter)':30s} {import_time:10.3f} {process_time:11.3f}  {heavy}")
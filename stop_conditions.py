@@ -0,0 +1,143 @@
+"""Stop a simulation as soon as it has answered its question.
+
+StopConditions checks its conditions from inside the integration (via
+CVode.event callbacks, which also work with fixed step) and sets h.stoprun
+when one is met, so h.continuerun(tstop) returns early. Supported conditions:
+
+  steady_state  -- max |dc/dt| over a species' nodes, or the "maximum
+                   variation" max(c) - min(c) used in conservation_of_mass.py,
+                   falls below a tolerance
+  threshold     -- a pointer (exact, via StateTransitionEvent) or any node of a
+                   node set (checked every check_interval) crosses a value
+  wall_time     -- the run has taken longer than a budget in seconds
+
+Example:
+
+    stop = StopConditions(check_interval=1 * ms)
+    stop.steady_state(ca, tolerance=1e-9)
+    stop.wall_time(3600)
+    h.finitialize(-65 * mV)
+    h.continuerun(100 * s)
+    print(stop.reason, stop.stop_time)
+    stop.remove()
+
+An instance stays registered with finitialize (and keeps its conditions)
+until remove() is called, or until the end of a with block:
+
+    with StopConditions() as stop:
+        stop.threshold(0.5, ref=seg._ref_cai)
+        h.finitialize(-65 * mV)
+        h.continuerun(1 * s)
+"""
+import time
+import numpy as np
+from neuron import h
+
+
+class StopConditions:
+    def __init__(self, check_interval=1):
+        self.check_interval = check_interval
+        self.reason = None
+        self.stop_time = None
+        self._checks = []
+        self._transitions = []
+        self._levels = []
+        self._fih = h.FInitializeHandler(self._on_finitialize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.remove()
+        return False
+
+    def remove(self):
+        """stop acting on later runs; the finitialize handler is deleted with the last reference to it"""
+        self._fih = None
+        self._checks = []
+        self._transitions = []
+        self._levels = []
+
+    def _on_finitialize(self):
+        self.reason = None
+        self.stop_time = None
+        self._start = time.perf_counter()
+        for check in self._checks:
+            check["previous"] = None
+        for ste in self._transitions:
+            ste.state(0)
+        if self._checks:
+            h.CVode().event(h.t + self.check_interval, self._check)
+
+    def _stop(self, reason):
+        if self.reason is None:
+            self.reason = reason
+            self.stop_time = h.t
+        h.stoprun = 1
+
+    def _check(self):
+        if self._fih is None:
+            # removed during a run; let the pending check lapse
+            return
+        for check in self._checks:
+            if check["test"](check):
+                self._stop(check["name"])
+                return
+        h.CVode().event(h.t + self.check_interval, self._check)
+
+    def steady_state(self, species, tolerance, metric="derivative"):
+        """stop when the species stops changing
+
+        metric="derivative": max |dc/dt| (mM/ms) between checks < tolerance
+        metric="variation": max(c) - min(c) (mM) < tolerance
+        """
+        if metric not in ("derivative", "variation"):
+            raise ValueError(f"unsupported steady state metric: {metric}")
+
+        def test(check):
+            values = np.array(species.nodes.concentration)
+            if metric == "variation":
+                return values.max() - values.min() < tolerance
+            previous, check["previous"] = check["previous"], (h.t, values)
+            if previous is None:
+                return False
+            t0, values0 = previous
+            return np.max(np.abs(values - values0)) / (h.t - t0) < tolerance
+
+        self._checks.append({"name": f"steady state ({metric})", "test": test, "previous": None})
+
+    def threshold(self, value, ref=None, nodes=None, rising=True):
+        """stop when a pointer or any node in a node set crosses value
+
+        A pointer (e.g. seg._ref_cai) is watched exactly by a
+        StateTransitionEvent; node sets are checked every check_interval.
+        """
+        if (ref is None) == (nodes is None):
+            raise ValueError("specify exactly one of ref or nodes")
+        name = f"threshold {value} {'rising' if rising else 'falling'}"
+        if ref is not None:
+            level = h.ref(value)
+            ste = h.StateTransitionEvent(1)
+            if rising:
+                ste.transition(0, 0, ref, level, lambda: self._stop(name))
+            else:
+                ste.transition(0, 0, level, ref, lambda: self._stop(name))
+            # the level must stay alive as long as the event
+            self._levels.append(level)
+            self._transitions.append(ste)
+        else:
+            def test(check):
+                values = np.array(nodes.value)
+                return values.max() >= value if rising else values.min() <= value
+
+            self._checks.append({"name": name, "test": test, "previous": None})
+
+    def wall_time(self, seconds):
+        """stop when the run has used more than seconds of wall time"""
+        self._checks.append(
+            {
+                "name": f"wall time {seconds} s",
+                "test": lambda check: time.perf_counter() - self._start > seconds,
+                "previous": None,
+            }
+        )
@@ -0,0 +1,123 @@
+"""Many synaptic flux sources into rxd voxels, updated together each step.
+
+rxdsyn-test.py couples one RxDSyn point process to one voxel with
+node.include_flux(syn._ref_g); with thousands of synapses that is thousands
+of point processes, NetCons into them, and one flux pointer per synapse.
+SynapseArray instead keeps every synapse's conductance-like flux g in a NumPy
+array with the same dynamics as RxDSyn (g' = -g / tau, g += weight on each
+event):
+
+  - incoming events are recorded into shared vectors by target-less NetCons
+    (no Python callback per spike),
+  - once per time step a single callback decays g analytically, adds the
+    events that have arrived, and sums g into one flux value per voxel
+    (several synapses may share a voxel),
+  - each voxel includes its flux through a pointer into one h.Vector.
+
+With fixed step this follows NEURON's timing for RxDSyn exactly: an event is
+applied at the start of the step within half a step of its arrival, and rxd
+reads g after cnexp has decayed it over the step. With variable step, g is
+held at its value at the start of each step.
+
+Synapses must all be given when the array is built, because the flux pointers
+refer into a vector that cannot be resized afterwards.
+"""
+import numpy as np
+from neuron import h
+
+
+class SynapseArray:
+    def __init__(self, nodes, sources, weights, delays=0, tau=0.1):
+        """nodes -- the voxel (rxd node) each synapse injects into
+        sources -- the NetCon source of each synapse: an object such as a
+            NetStim, or a (pointer, section) pair such as
+            (soma(0.5)._ref_v, soma) for a presynaptic cell's spikes
+        weights, delays -- per synapse, or a single value for all
+        tau -- decay time constant (ms), as RxDSyn
+        """
+        num_synapses = len(nodes)
+        self.tau = tau
+        self.weights = np.broadcast_to(np.asarray(weights, dtype=float), num_synapses).copy()
+        self.delays = np.broadcast_to(np.asarray(delays, dtype=float), num_synapses).copy()
+        self.g = np.zeros(num_synapses)
+
+        # one flux slot per distinct voxel
+        slots = {}
+        self.slot_of_synapse = np.empty(num_synapses, dtype=int)
+        slot_nodes = []
+        for i, node in enumerate(nodes):
+            if node._index not in slots:
+                slots[node._index] = len(slot_nodes)
+                slot_nodes.append(node)
+            self.slot_of_synapse[i] = slots[node._index]
+        self.flux = h.Vector(len(slot_nodes))
+        self._flux = self.flux.as_numpy()
+        for slot, node in enumerate(slot_nodes):
+            node.include_flux(self.flux._ref_x[slot])
+        self.nodes = slot_nodes
+
+        # spikes from every source land in these two vectors
+        self._spike_times = h.Vector()
+        self._spike_ids = h.Vector()
+        self._netcons = []
+        for i, source in enumerate(sources):
+            if isinstance(source, tuple):
+                pointer, sec = source
+                nc = h.NetCon(pointer, None, sec=sec)
+            else:
+                nc = h.NetCon(source, None)
+            nc.record(self._spike_times, self._spike_ids, i)
+            self._netcons.append(nc)
+
+        self._fih = h.FInitializeHandler(self._on_finitialize)
+        h.CVode().extra_scatter_gather(0, self._update)
+
+    def _on_finitialize(self):
+        self.g[:] = 0
+        self._flux[:] = 0
+        self._t_last = h.t
+        self._num_seen = 0
+        self._pending_times = np.empty(0)
+        self._pending_ids = np.empty(0, dtype=int)
+
+    def _update(self):
+        t = h.t
+        fixed_step = not h.CVode().active()
+        if t > self._t_last:
+            self.g *= np.exp(-(t - self._t_last) / self.tau)
+            self._t_last = t
+
+        # collect spikes recorded since the last step; they arrive after their delay
+        if len(self._spike_times) > self._num_seen:
+            ids = np.array(self._spike_ids.as_numpy()[self._num_seen:], dtype=int)
+            times = self._spike_times.as_numpy()[self._num_seen:] + self.delays[ids]
+            self._num_seen = len(self._spike_times)
+            self._pending_times = np.concatenate([self._pending_times, times])
+            self._pending_ids = np.concatenate([self._pending_ids, ids])
+
+        if len(self._pending_times):
+            if fixed_step:
+                # as NEURON delivers events with fixed step: at the start of the
+                # step within half a step of their arrival, with their full weight
+                ready = self._pending_times <= t + h.dt / 2
+            else:
+                ready = self._pending_times <= t
+            if ready.any():
+                ids = self._pending_ids[ready]
+                if fixed_step:
+                    np.add.at(self.g, ids, self.weights[ids])
+                else:
+                    # decay each event from its arrival time to now
+                    np.add.at(self.g, ids, self.weights[ids] * np.exp(-(t - self._pending_times[ready]) / self.tau))
+                self._pending_times = self._pending_times[~ready]
+                self._pending_ids = self._pending_ids[~ready]
+
+        g = self.g
+        if fixed_step:
+            # rxd reads RxDSyn's g after cnexp has advanced it over the step
+            g = g * np.exp(-h.dt / self.tau)
+        self._flux[:] = np.bincount(self.slot_of_synapse, weights=g, minlength=len(self._flux))
+
+    def remove(self):
+        """stop updating; the voxels keep their (now constant) flux pointers"""
+        h.CVode().extra_scatter_gather_remove(self._update)
@@ -0,0 +1,99 @@
+import multiprocessing
+import random
+import sqlite3
+import sys
+import time
+import pandas as pd
+from neuron import h, rxd
+from neuron.units import um, ms, mV
+from synapse_array import SynapseArray
+
+# requires rxdsyn.mod to be compiled (nrnivmodl) for the RxDSyn comparison
+
+h.load_file("stdrun.hoc")
+
+DB_FILENAME = "synapse_array.db"
+TSTOP = 20 * ms
+# largest relative difference in injected mass between the two methods
+MASS_RTOL = 1e-6
+
+
+def run_sim(num_synapses, method, dx=0.1 * um, seed=1):
+    rxd.set_solve_type(dimension=3)
+    dend = h.Section(name="dend")
+    dend.L = 20 * um
+    dend.diam = 2 * um
+    cyt = rxd.Region([dend], dx=dx)
+    c = rxd.Species(cyt, d=0.1 * um ** 2 / ms)
+
+    # synapses on random surface voxels, each driven by its own NetStim
+    rng = random.Random(seed)
+    surface_nodes = [node for node in c.nodes if node.surface_area]
+    targets = [rng.choice(surface_nodes) for _ in range(num_synapses)]
+    stims = []
+    for _ in range(num_synapses):
+        ns = h.NetStim()
+        ns.number = 3
+        ns.start = rng.uniform(1, 5) * ms
+        ns.interval = rng.uniform(2, 5) * ms
+        ns.noise = 0
+        stims.append(ns)
+
+    start = time.perf_counter()
+    if method == "rxdsyn":
+        # one point process, NetCon and flux pointer per synapse (as rxdsyn-test.py)
+        syns = []
+        netcons = []
+        for node, ns in zip(targets, stims):
+            r = h.RxDSyn(node.segment)
+            node.include_flux(r._ref_g)
+            nc = h.NetCon(ns, r)
+            nc.weight[0] = 10000
+            nc.delay = 0
+            syns.append(r)
+            netcons.append(nc)
+    else:
+        syns = SynapseArray(targets, stims, weights=10000, tau=0.1 * ms)
+    build_time = time.perf_counter() - start
+
+    h.finitialize(-65 * mV)
+    start = time.perf_counter()
+    h.continuerun(TSTOP)
+    run_time = time.perf_counter() - start
+
+    data = pd.DataFrame(
+        {
+            "num_synapses": [num_synapses],
+            "method": [method],
+            "dx": [dx],
+            "num_voxels": [len(c.nodes)],
+            "build_time": [build_time],
+            "run_time": [run_time],
+            "total_mass": [sum(node.concentration * node.volume for node in c.nodes)],
+        }
+    )
+    print(data.to_string(index=False))
+    with sqlite3.connect(DB_FILENAME) as conn:
+        data.to_sql("data", conn, if_exists="append", index=False)
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 1000, 5000]
+    for num_synapses in counts:
+        for method in ["rxdsyn", "array"]:
+            p = multiprocessing.Process(target=run_sim, args=(num_synapses, method))
+            p.start()
+            p.join()
+
+    with sqlite3.connect(DB_FILENAME) as conn:
+        data = pd.read_sql("SELECT * FROM data", conn)
+    data = data.groupby(["num_synapses", "method"])[["build_time", "run_time", "total_mass"]].min().unstack("method")
+    data["speedup"] = data["run_time"]["rxdsyn"] / data["run_time"]["array"]
+    data["mass_difference"] = (data["total_mass"]["array"] / data["total_mass"]["rxdsyn"] - 1).abs()
+    print(data)
+
+    disagree = data[~(data["mass_difference"] <= MASS_RTOL)]
+    if len(disagree):
+        print(f"injected mass differs by more than {MASS_RTOL} (relative) for num_synapses = {list(disagree.index)}")
+        sys.exit(1)
+    print(f"injected mass agrees to within {MASS_RTOL} (relative) for every num_synapses")
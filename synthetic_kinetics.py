@@ -0,0 +1,84 @@
+"""Synthetic reaction networks of tunable size for cost benchmarks.
+
+synthetic(num_species, num_reactions, complexity) returns a kinetics function
+in the style of those in thread_scaling.py: called with a morphology object
+(Cylinder or Cell) it builds the regions, species and reactions and returns
+them in a dict. Each reaction is an rxd.Rate on one species whose expression
+is a sum of `complexity` saturating terms
+
+    k * K * a / (K + a) / (1 + b * c / K ** 2)
+
+over randomly chosen species a, b, c, minus a linear decay. Each term is at
+most k * K, so a species produced by m terms stays below its initial value
+plus m * max(k) * K / DECAY_RATE: the network cannot blow up, whatever its
+size. The network is reproducible for a given seed.
+
+    python synthetic_kinetics.py   -- integrate the largest network of
+                                      reaction_cost_benchmark.py and check
+                                      that it stays finite and bounded
+"""
+import random
+import sys
+from neuron import rxd
+from neuron.units import um, ms, mM
+
+DECAY_RATE = 1 / ms
+SATURATION = 1 * mM
+MAX_RATE_CONSTANT = 1 / ms
+
+
+def synthetic(num_species, num_reactions, complexity=1, d=1 * um ** 2 / ms, seed=1):
+    def kinetics(obj):
+        rng = random.Random(seed)
+        cyt = rxd.Region(obj.all, name="cyt", dx=obj.dx)
+        species = [
+            rxd.Species(
+                cyt,
+                d=d,
+                name=f"s{i}",
+                initial=lambda node: 1 * mM if node in obj.start else 0.1 * mM,
+            )
+            for i in range(num_species)
+        ]
+        reactions = []
+        for j in range(num_reactions):
+            target = species[j % num_species]
+            rate = -DECAY_RATE * target
+            for _ in range(complexity):
+                a, b, c = (rng.choice(species) for _ in range(3))
+                k = rng.uniform(0.1, 1) * MAX_RATE_CONSTANT
+                rate += k * SATURATION * a / (SATURATION + a) / (1 + b * c / SATURATION ** 2)
+            reactions.append(rxd.Rate(target, rate))
+        return {
+            "name": f"synthetic-{num_species}-{num_reactions}-{complexity}" + ("" if d else "-nodiffusion"),
+            "regions": [cyt],
+            "species": species,
+            "reactions": reactions,
+        }
+
+    return kinetics
+
+
+def bound(num_species, num_reactions, complexity, initial=1 * mM):
+    """upper bound on any concentration of synthetic(num_species, num_reactions, complexity)"""
+    terms_per_species = -(-num_reactions // num_species) * complexity
+    return initial + terms_per_species * MAX_RATE_CONSTANT * SATURATION / DECAY_RATE
+
+
+if __name__ == "__main__":
+    import numpy as np
+    from neuron import h
+    from thread_scaling import Cylinder
+
+    h.load_file("stdrun.hoc")
+    num_species, num_reactions, complexity = 8, 16, 4
+    rxd.set_solve_type(dimension=3)
+    my_kinetics = synthetic(num_species, num_reactions, complexity)(Cylinder(0.25))
+    h.finitialize(-65)
+    h.continuerun(30 * ms)
+    values = np.concatenate([np.array(species.nodes.concentration) for species in my_kinetics["species"]])
+    limit = bound(num_species, num_reactions, complexity)
+    print(f"{my_kinetics['name']} at t = {h.t} ms: concentrations in [{values.min()}, {values.max()}] mM, bound {limit} mM")
+    if not (np.all(np.isfinite(values)) and values.max() <= limit):
+        print("the network diverged")
+        sys.exit(1)
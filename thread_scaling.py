@@ -1,19 +1,23 @@
 import time
+import sys
 import multiprocessing
 import sqlite3
-import pandas as pd
 from neuron import h, rxd
 from neuron.units import mV, ms, um, mM
-
-h.load_file("stdrun.hoc")
-h.load_file("import3d.hoc")
+from profiling import MemoryTracker, insert_rows
 
 DB_FILENAME = "thread_scaling.db"
 SWC_FILENAME = "B4-CA1-L-D63x1zACR3_1.CNG.swc.txt"
 NUM_RUNS = 3
 
+# agreement required between thread counts in the in-process sweep
+RESULT_RTOL = 1e-6
+RESULT_ATOL = 1e-12
+
 class Cell:
     def __init__(self, dx):
+        # loaded here rather than at import so workers building a Cylinder skip it
+        h.load_file("import3d.hoc")
         cell = h.Import3d_SWC_read()
         cell.input(SWC_FILENAME)
         i3d = h.Import3d_GUI(cell, False)
@@ -91,64 +95,147 @@ def cawave(obj,
     }
 
 
+# (dx, morphology, kinetics, nthread) already in the database; read without pandas to keep workers light
 try:
     with sqlite3.connect(DB_FILENAME) as conn:
-        old_data = pd.read_sql("SELECT * FROM data", conn)
-except:
-    old_data = pd.DataFrame({"nthread": [], "morphology": [], "kinetics": [], "dx": [], "runcount": [], "runtime": []})
+        done = set(conn.execute("SELECT dx, morphology, kinetics, nthread FROM data"))
+except sqlite3.OperationalError:
+    done = set()
 
 
-def run_sim(nthread, morphology, kinetics, dx):
-    # setup the model
-    rxd.nthread(nthread)
-    rxd.set_solve_type(dimension=3)
-    morph = morphology(dx)
-    my_kinetics = kinetics(morph)
+def already_done(morph, my_kinetics, nthread):
+    return (morph.dx, morph.name, my_kinetics["name"], nthread) in done
 
-    # skip if we've already done this
-    if any((old_data["dx"] == dx) & (old_data["morphology"] == morph.name) & (old_data["kinetics"] == my_kinetics["name"]) & (old_data["nthread"] == nthread)):
-        print(f"skipping: dx: {dx}, morph: {morph.name}, kinetics: {my_kinetics['name']}, nthread: {nthread}")
-        return
-    
-    print(f"running: dx: {dx}, morph: {morph.name}, kinetics: {my_kinetics['name']}, nthread: {nthread}")
 
-    # run the sim several times
+def time_runs(nthread, morph, my_kinetics, memory):
+    """run the already-built model NUM_RUNS times; return the rows to store"""
     times = []
+    memory_records = []
     for run in range(NUM_RUNS):
         print(f"  run #{run + 1}")
         initial_time = time.perf_counter()
         h.finitialize(-65 * mV)
+        if memory.build_rss is None:
+            memory.end_build()
         start_time = time.perf_counter()
         print(f"    initialization time: {start_time - initial_time}")
         h.continuerun(100 * ms)
         end_time = time.perf_counter()
+        memory.end_run()
         times.append(end_time - start_time)
+        num_voxels = sum(len(species.nodes) for species in my_kinetics["species"])
+        memory_records.append(memory.record(num_voxels))
         print(f"    elapsed: {end_time - start_time} s")
-    
-    # store the data in the database
-    data = pd.DataFrame(
+        print(f"    peak RSS: {memory.run_peak_rss} bytes")
+
+    return [
         {
             "nthread": nthread,
             "morphology": morph.name,
             "kinetics": my_kinetics['name'],
-            "dx": dx,
-            "runcount": range(NUM_RUNS),
-            "runtime": times
+            "dx": morph.dx,
+            "runcount": run,
+            "runtime": runtime,
+            "num_voxels": num_voxels,
+            **record,
         }
-    )
+        for run, (runtime, record) in enumerate(zip(times, memory_records))
+    ]
+
+
+def save_data(rows):
     with sqlite3.connect(DB_FILENAME) as conn:
-        data.to_sql("data", conn, if_exists="append", index=False)    
+        insert_rows(conn, "data", rows)
+
+
+def run_sim(nthread, morphology, kinetics, dx):
+    # setup the model; stdrun.hoc is loaded here rather than at import
+    h.load_file("stdrun.hoc")
+    memory = MemoryTracker()
+    rxd.nthread(nthread)
+    rxd.set_solve_type(dimension=3)
+    morph = morphology(dx)
+    my_kinetics = kinetics(morph)
+
+    # skip if we've already done this
+    if already_done(morph, my_kinetics, nthread):
+        print(f"skipping: dx: {dx}, morph: {morph.name}, kinetics: {my_kinetics['name']}, nthread: {nthread}")
+        return
+    
+    print(f"running: dx: {dx}, morph: {morph.name}, kinetics: {my_kinetics['name']}, nthread: {nthread}")
+
+    # run the sim several times and store the data in the database
+    save_data(time_runs(nthread, morph, my_kinetics, memory))
+
+
+def run_sweep(nthreads, morphology, kinetics, dx, rtol=RESULT_RTOL, atol=RESULT_ATOL):
+    """build the model once and time it for each thread count in nthreads
+
+    The final state after each count's runs is checked against the first
+    count's; threading only changes the order of floating point operations, so
+    the results must agree to within tolerance.
+    """
+    import numpy as np
+
+    h.load_file("stdrun.hoc")
+    memory = MemoryTracker()
+    rxd.set_solve_type(dimension=3)
+    morph = morphology(dx)
+    my_kinetics = kinetics(morph)
+
+    todo = [nthread for nthread in nthreads if not already_done(morph, my_kinetics, nthread)]
+    for nthread in sorted(set(nthreads) - set(todo)):
+        print(f"skipping: dx: {dx}, morph: {morph.name}, kinetics: {my_kinetics['name']}, nthread: {nthread}")
+    if not todo:
+        return
+
+    reference = None
+    for nthread in todo:
+        print(f"running: dx: {dx}, morph: {morph.name}, kinetics: {my_kinetics['name']}, nthread: {nthread}")
+        rxd.nthread(nthread)
+        data = time_runs(nthread, morph, my_kinetics, memory)
+        result = np.concatenate([np.array(species.nodes.value) for species in my_kinetics["species"]])
+        if reference is None:
+            reference_nthread, reference = nthread, result
+        else:
+            assert np.allclose(result, reference, rtol=rtol, atol=atol), (
+                f"nthread={nthread} differs from nthread={reference_nthread}: "
+                f"max abs difference {np.max(np.abs(result - reference))}"
+            )
+        save_data(data)
 
 
 if __name__ == "__main__":
+    # python thread_scaling.py            -- one process per (model, nthread)
+    # python thread_scaling.py sweep      -- one process per model, sweeping nthread in-process
+    in_process = len(sys.argv) > 1 and sys.argv[1] == "sweep"
+    nthreads = [1, 2, 3, 4, 5, 6, 7, 8]
+    failures = []
     for dx in [0.12, 0.06]:
         for morphology in [Cylinder, Cell]:
             for kinetics in [cawave, diffusion_only, bistable]:
-                for nthread in [1, 2, 3, 4, 5, 6, 7, 8]:
+                if in_process:
+                    p = multiprocessing.Process(
+                        target=run_sweep, args=(nthreads, morphology, kinetics, dx)
+                    )
+                    p.start()
+                    p.join()
+                    if p.exitcode:
+                        # e.g. thread counts disagreeing; the counts after the failing one were not run
+                        failures.append(f"dx: {dx}, morph: {morphology.__name__}, kinetics: {kinetics.__name__}")
+                    continue
+                for nthread in nthreads:
                     p = multiprocessing.Process(
                         target=run_sim, args=(nthread, morphology, kinetics, dx)
                     )
                     p.start()
-                    p.join()      
-
- 
\ No newline at end of file
+                    p.join()
+                    if p.exitcode:
+                        failures.append(
+                            f"dx: {dx}, morph: {morphology.__name__}, kinetics: {kinetics.__name__}, nthread: {nthread}"
+                        )
+    if failures:
+        print(f"{len(failures)} failed (exit code != 0, see the tracebacks above):")
+        for failure in failures:
+            print(f"    {failure}")
+        sys.exit(1)
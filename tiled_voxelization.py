@@ -0,0 +1,243 @@
+"""Run rxd's 3D discretization with its voxel work on a pool of processes.
+
+rxd's 3D discretization (rxd.re_init(), see time_discretization.py) runs on a
+single core and its cost grows like dx^-2 to dx^-3. Most of that cost is in
+FullJoinMorph.fullmorph (see profiling.DISCRETIZATION_PHASES), which
+
+  - classifies the grid against each constructive geometry object with
+    GeneralizedVoxelization.voxelize ("inside_outside"), then
+  - computes the partial volume (simplevolume) and surface area
+    (surface_area) of each surface voxel.
+
+Each of those calls is a pure function of its arguments, so
+ParallelDiscretization computes them ahead of time on a pool of forked
+workers, one task per object and one per tile of surface voxels, and hands
+fullmorph the results as it asks for them. fullmorph itself, and everything
+rxd does with its output, is unchanged: the voxels, volumes, surface areas
+and segment assignments are rxd's own, bit for bit, whatever the number of
+workers.
+
+The work lists are read from fullmorph's local variables (final_seg_dict,
+object_pts, total_surface_voxels); a call that was not computed ahead of time
+(e.g. if a NEURON version renames them) runs in the calling process, so the
+result never depends on them. The rest of fullmorph (grid setup, assigning
+voxels to segments) and of re_init stays serial.
+
+    with ParallelDiscretization(num_workers=8):
+        rxd.re_init()
+
+    python tiled_voxelization.py [dx] [swc_file]   -- serial vs parallel on the
+                                                      largest morphology in swc/
+"""
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+
+TILE_SIZE = 8
+
+_FULLJOINMORPH = "neuron.rxd.geometry3d.FullJoinMorph"
+
+# (function, arguments) of the calls being computed; set before forking so
+# the workers inherit the geometry objects instead of pickling them
+_work = None
+
+
+def _run_task(task):
+    function, calls = _work
+    return [function(*calls[i]) for i in task]
+
+
+def _volume_and_area(simplevolume, surface_area):
+    def compute(itemlist, distances, vox, grid):
+        return simplevolume(itemlist, distances, vox, grid), surface_area(itemlist, vox, grid)
+
+    return compute
+
+
+class ParallelDiscretization:
+    def __init__(self, num_workers=None, tile_size=TILE_SIZE):
+        """num_workers -- worker processes (default: one per core); 1 runs serially
+        tile_size -- surface voxels are sent to the workers in cubes of this many voxels a side
+        """
+        self.num_workers = num_workers or len(os.sched_getaffinity(0))
+        self.tile_size = tile_size
+        self.num_precomputed = 0
+        self.num_serial = 0
+        self._module = None
+
+    def __enter__(self):
+        import importlib
+
+        self._module = importlib.import_module(_FULLJOINMORPH)
+        self._originals = {
+            name: getattr(self._module, name) for name in ("voxelize", "simplevolume", "surface_area")
+        }
+        self._voxels = {}
+        self._surface = {}
+        self._voxels_source = self._surface_source = None
+        self._module.voxelize = self._voxelize
+        self._module.simplevolume = self._simplevolume
+        self._module.surface_area = self._surface_area
+        return self
+
+    def __exit__(self, *args):
+        for name, original in self._originals.items():
+            setattr(self._module, name, original)
+        self._voxels = {}
+        self._surface = {}
+        self._voxels_source = self._surface_source = None
+        return False
+
+    def _map(self, function, calls, tasks):
+        """results of function(*calls[i]) for the i in each task, in the order of calls"""
+        global _work
+        _work = (function, calls)
+        try:
+            if self.num_workers == 1:
+                results = [_run_task(task) for task in tasks]
+            else:
+                with multiprocessing.get_context("fork").Pool(self.num_workers) as pool:
+                    results = pool.map(_run_task, tasks, chunksize=max(1, len(tasks) // (8 * self.num_workers)))
+        finally:
+            _work = None
+        ordered = [None] * len(calls)
+        for task, task_results in zip(tasks, results):
+            for i, result in zip(task, task_results):
+                ordered[i] = result
+        self.num_precomputed += len(calls)
+        return ordered
+
+    def _caller_locals(self, *names):
+        """the named local variables of fullmorph, found up the stack (past
+        any wrappers such as PhaseTimer's), or None"""
+        frame = sys._getframe(1)
+        while frame is not None:
+            if frame.f_code.co_name == "fullmorph" and all(name in frame.f_locals for name in names):
+                return [frame.f_locals[name] for name in names]
+            frame = frame.f_back
+        return None
+
+    def _voxelize(self, grid, item, corners=None, *args, **kwargs):
+        found = self._caller_locals("final_seg_dict", "object_pts")
+        if found is not None and found[0] is not self._voxels_source:
+            # the first call of this fullmorph: voxelize all its objects
+            final_seg_dict, object_pts = found
+            self._voxels_source = final_seg_dict
+            items = list({id(item): item for items in final_seg_dict.values() for item in items}.values())
+            calls = [(grid, item, object_pts.get(item)) for item in items]
+            results = self._map(self._originals["voxelize"], calls, [[i] for i in range(len(calls))])
+            self._voxels = {id(item): (item, grid, call[2], result) for item, call, result in zip(items, calls, results)}
+        cached = self._voxels.pop(id(item), None)
+        if cached is not None and cached[0] is item and cached[1] is grid and cached[2] is corners:
+            return cached[3]
+        self.num_serial += 1
+        return self._originals["voxelize"](grid, item, corners, *args, **kwargs)
+
+    def _precompute_surface(self, grid):
+        found = self._caller_locals("total_surface_voxels")
+        if found is None or found[0] is self._surface_source:
+            return
+        (total_surface_voxels,) = found
+        self._surface_source = total_surface_voxels
+        voxels = [
+            vox for vox, (itemlist, distances, seg) in total_surface_voxels.items()
+            if not self._module.all_in(distances)
+        ]
+        calls = [(total_surface_voxels[vox][0], total_surface_voxels[vox][1], vox, grid) for vox in voxels]
+        tiles = {}
+        for index, (i, j, k) in enumerate(voxels):
+            tiles.setdefault((i // self.tile_size, j // self.tile_size, k // self.tile_size), []).append(index)
+        compute = _volume_and_area(self._originals["simplevolume"], self._originals["surface_area"])
+        results = self._map(compute, calls, list(tiles.values()))
+        self._surface = {call[2]: (call, result) for call, result in zip(calls, results)}
+
+    def _cached_surface(self, itemlist, distances, vox, grid):
+        cached = self._surface.get(vox)
+        if cached is None:
+            return None
+        (cached_itemlist, cached_distances, _, cached_grid), result = cached
+        if (
+            cached_grid is grid
+            and len(cached_itemlist) == len(itemlist)
+            and all(a is b for a, b in zip(cached_itemlist, itemlist))
+            and (distances is None or cached_distances == distances)
+        ):
+            return result
+        return None
+
+    def _simplevolume(self, flist, distances, voxel, g):
+        self._precompute_surface(g)
+        cached = self._cached_surface(flist, distances, voxel, g)
+        if cached is not None:
+            return cached[0]
+        self.num_serial += 1
+        return self._originals["simplevolume"](flist, distances, voxel, g)
+
+    def _surface_area(self, itemlist, vox, grid):
+        cached = self._cached_surface(itemlist, None, vox, grid)
+        if cached is not None:
+            return cached[1]
+        self.num_serial += 1
+        return self._originals["surface_area"](itemlist, vox, grid)
+
+
+def discretization_digest(species):
+    """hash of every 3D node's position, volume, surface area and segment"""
+    digest = hashlib.sha1()
+    for node in species.nodes:
+        # the section name without the cell object's address, which differs between processes
+        section = node.segment.sec.name().rsplit(".", 1)[-1]
+        digest.update(repr((node.x3d, node.y3d, node.z3d, node.volume, node.surface_area, section, node.segment.x)).encode())
+    return digest.hexdigest()
+
+
+def _discretize(filename, dx, num_workers, results):
+    from neuron import rxd
+    from time_discretization import Cell
+
+    cell = Cell(filename)
+    rxd.set_solve_type(cell.all, dimension=3)
+    cyt = rxd.Region(cell.all, name="cyt", dx=dx)
+    x = rxd.Species(cyt, name="x")
+    start = time.perf_counter()
+    if num_workers is None:
+        rxd.re_init()
+    else:
+        with ParallelDiscretization(num_workers) as parallel:
+            rxd.re_init()
+        print(f"    {parallel.num_precomputed} calls precomputed, {parallel.num_serial} made by rxd's process")
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, len(x.nodes), sum(x.nodes.volume), sum(x.nodes.surface_area), discretization_digest(x)))
+
+
+def discretize(filename, dx, num_workers=None):
+    """(re_init time, voxels, volume, surface area, digest) in a fresh process;
+    num_workers=None runs rxd as is"""
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_discretize, args=(filename, dx, num_workers, results))
+    p.start()
+    result = results.get()
+    p.join()
+    return result
+
+
+if __name__ == "__main__":
+    dx = float(sys.argv[1]) if len(sys.argv) > 1 else 0.25
+    if len(sys.argv) > 2:
+        filename = sys.argv[2]
+    else:
+        filename = max((os.path.join("swc", name) for name in os.listdir("swc")), key=os.path.getsize)
+    print(f"{filename}, dx={dx}")
+
+    serial_time, num_voxels, volume, area, reference = discretize(filename, dx)
+    print(f"rxd: {serial_time:.2f} s, {num_voxels} voxels, volume {volume:.6g} µm^3, surface area {area:.6g} µm^2")
+
+    num_cores = len(os.sched_getaffinity(0))
+    num_workers = 1
+    while num_workers <= max(num_cores, 2):
+        elapsed, *_, digest = discretize(filename, dx, num_workers)
+        print(f"{num_workers} workers: {elapsed:.2f} s, speedup {serial_time / elapsed:.2f}, "
+              f"identical to rxd: {digest == reference}")
+        num_workers *= 2
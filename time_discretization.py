@@ -1,49 +1,100 @@
+import sqlite3
+import sys
 import time
 from neuron import h, rxd
-
-h.load_file("import3d.hoc")
+from profiling import PhaseTimer, MemoryTracker, DISCRETIZATION_PHASES, insert_rows
 
 
 class Cell:
     def __init__(self, filename):
+        # loaded here rather than at import so workers that exit early skip it
+        h.load_file("import3d.hoc")
         cell = h.Import3d_SWC_read()
         cell.input(filename)
         i3d = h.Import3d_GUI(cell, False)
         i3d.instantiate(self)
 
 
-if __name__ == "__main__":
-    import pandas as pd
-    import sqlite3
-    import sys
+def already_stored(conn, filename, dx):
+    table_exists = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='morphology'"
+    ).fetchone()
+    return table_exists and conn.execute(
+        "SELECT 1 FROM morphology WHERE morphology=? AND dx=?", (filename, dx)
+    ).fetchone()
 
-    conn = sqlite3.connect("discretization.db")
-    filename = sys.argv[1]
-    dx = float(sys.argv[2])
+
+def run(filename, dx):
+    """discretize one morphology at dx and store the timings in discretization.db"""
+    conn = sqlite3.connect("discretization.db", timeout=60, isolation_level=None)
+    if already_stored(conn, filename, dx):
+        # another job stored it since do_timings.py read the database
+        print(f"already stored: dx: {dx}, morph: {filename}")
+        return
     print(f"processing {filename} at dx={dx}")
+    memory = MemoryTracker()
     cell = Cell(filename)
     rxd.set_solve_type(cell.all, dimension=3)
     cyt = rxd.Region(cell.all, name="cyt", dx=dx)
     x = rxd.Species(cyt, name="x")
-    start = time.perf_counter()
-    rxd.re_init()
-    elapsed = time.perf_counter() - start
+    with PhaseTimer(DISCRETIZATION_PHASES) as timer:
+        start = time.perf_counter()
+        rxd.re_init()
+        elapsed = time.perf_counter() - start
     print(f"elapsed time: {elapsed} sec")
+    accounted_time = 0
+    for phase, result in timer.results.items():
+        print(f"    {phase}: {result['wall_time']} sec, peak RSS {result['peak_rss']} bytes")
+        accounted_time += result["wall_time"] or 0
+    timer.results["other"] = {"wall_time": elapsed - accounted_time, "peak_rss": None}
+    memory.end_build(
+        peak=max([result["peak_rss"] or 0 for result in timer.results.values()])
+    )
+    num_voxels = len(x.nodes)
+    print(f"peak RSS: {memory.build_peak_rss} bytes, RSS after build: {memory.build_rss} bytes")
     surface_area = sum(x.nodes.surface_area)
     volume = sum(x.nodes.volume)
-    data = pd.DataFrame(
-        {
-            "morphology": [filename],
-            "dx": [dx],
-            "volume": [volume],
-            "surface_area": [surface_area],
-            "num_voxels": [len(x.nodes)],
-            "num_surface_voxels": [
-                len([node for node in x.nodes if node.surface_area])
+    row = {
+        "morphology": filename,
+        "dx": dx,
+        "volume": volume,
+        "surface_area": surface_area,
+        "num_voxels": num_voxels,
+        "num_surface_voxels": len([node for node in x.nodes if node.surface_area]),
+        "discretization_time": elapsed,
+        "num_sections": len(cell.all),
+        "sum_lengths": sum([sec.L for sec in cell.all]),
+        **memory.record(num_voxels),
+    }
+    # several of these may run at once (see do_timings.py); take the write lock
+    # before checking so each (morphology, dx) is stored exactly once
+    conn.execute("BEGIN IMMEDIATE")
+    if already_stored(conn, filename, dx):
+        print(f"already stored: dx: {dx}, morph: {filename}")
+    else:
+        insert_rows(conn, "morphology", [row])
+        insert_rows(
+            conn,
+            "phases",
+            [
+                {
+                    "morphology": filename,
+                    "dx": dx,
+                    "ics_partial_volume_resolution": rxd.options.ics_partial_volume_resolution,
+                    "phase": phase,
+                    "wall_time": result["wall_time"],
+                    "peak_rss": result["peak_rss"],
+                    "bytes_per_voxel": (
+                        (result["peak_rss"] - memory.baseline_rss) / num_voxels
+                        if result["peak_rss"] and num_voxels else None
+                    ),
+                }
+                for phase, result in timer.results.items()
             ],
-            "discretization_time": [elapsed],
-            "num_sections": [len(cell.all)],
-            "sum_lengths": [sum([sec.L for sec in cell.all])],
-        }
-    )
-    data.to_sql("morphology", conn, if_exists="append", index=False)
+        )
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    run(sys.argv[1], float(sys.argv[2]))
@@ -0,0 +1,93 @@
+"""Batched coordinate-to-voxel lookups for 3D rxd species.
+
+species.nodes((x, y, z)) scans every node for each query point. VoxelIndex
+hashes the voxels of a species (optionally in one region, optionally only
+surface voxels) by their integer grid position once; after that, lookups for
+whole arrays of points are vectorized with np.searchsorted:
+
+    index = VoxelIndex(c, surface_only=True)
+    nodes = index.nearest_nodes(points)          # points: (n, 3) array
+    neighborhoods = index.within(points, 1.0)    # node indices within 1 µm
+
+Points that do not fall in an indexed voxel are matched to the nearest voxel
+center by a brute-force search over the voxels, which is only needed for
+points off the morphology.
+"""
+import numpy as np
+from neuron.rxd.node import Node3D
+
+
+class VoxelIndex:
+    def __init__(self, species, region=None, surface_only=False):
+        self.nodes = [
+            node
+            for node in species.nodes
+            if isinstance(node, Node3D)
+            and (region is None or node.region == region)
+            and (not surface_only or node.surface_area)
+        ]
+        if not self.nodes:
+            raise ValueError("no 3D voxels to index")
+        regions = {node.region for node in self.nodes}
+        if len(regions) > 1:
+            raise ValueError("voxels from several regions (different grids); pass region")
+        grid = self.nodes[0].region._mesh_grid
+        self.origin = np.array([grid["xlo"], grid["ylo"], grid["zlo"]])
+        self.spacing = np.array([grid["dx"], grid["dy"], grid["dz"]])
+
+        ijk = np.array([(node._i, node._j, node._k) for node in self.nodes], dtype=np.int64)
+        # voxel (i, j, k) spans origin + [i, i + 1) * spacing, as Node3D.x3d etc.
+        self.centers = self.origin + (ijk + 0.5) * self.spacing
+        self._shape = ijk.max(axis=0) + 1
+        keys = self._keys(ijk)
+        self._order = np.argsort(keys)
+        self._sorted_keys = keys[self._order]
+
+    def _keys(self, ijk):
+        return (ijk[:, 0] * self._shape[1] + ijk[:, 1]) * self._shape[2] + ijk[:, 2]
+
+    def _lookup(self, ijk):
+        """node index for each grid position, or -1 where there is no indexed voxel"""
+        inside = np.all((ijk >= 0) & (ijk < self._shape), axis=1)
+        result = np.full(len(ijk), -1, dtype=np.int64)
+        keys = self._keys(ijk[inside])
+        positions = np.searchsorted(self._sorted_keys, keys)
+        positions[positions == len(self._sorted_keys)] = 0
+        found = self._sorted_keys[positions] == keys
+        inside_result = np.full(len(keys), -1, dtype=np.int64)
+        inside_result[found] = self._order[positions[found]]
+        result[inside] = inside_result
+        return result
+
+    def nearest(self, points):
+        """index into self.nodes of the voxel nearest to each point"""
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        ijk = np.floor((points - self.origin) / self.spacing).astype(np.int64)
+        result = self._lookup(ijk)
+        for i in np.flatnonzero(result < 0):
+            result[i] = np.argmin(np.sum((self.centers - points[i]) ** 2, axis=1))
+        return result
+
+    def nearest_nodes(self, points):
+        return [self.nodes[i] for i in self.nearest(points)]
+
+    def within(self, points, radius):
+        """for each point, the indices into self.nodes of voxels whose centers are within radius"""
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        reach = np.ceil(radius / self.spacing).astype(np.int64)
+        offsets = np.stack(
+            np.meshgrid(*[np.arange(-r, r + 1) for r in reach], indexing="ij"), axis=-1
+        ).reshape(-1, 3)
+        # the grid position of the nearest voxel center
+        base = np.rint((points - self.origin) / self.spacing - 0.5).astype(np.int64)
+        # (num_points, num_offsets) candidate grid positions, looked up all at once
+        candidates = self._lookup((base[:, None, :] + offsets[None, :, :]).reshape(-1, 3)).reshape(len(points), -1)
+        result = []
+        for point, row in zip(points, candidates):
+            row = row[row >= 0]
+            distances = np.sqrt(np.sum((self.centers[row] - point) ** 2, axis=1))
+            result.append(row[distances <= radius])
+        return result
+
+    def within_nodes(self, points, radius):
+        return [[self.nodes[i] for i in row] for row in self.within(points, radius)]
@@ -0,0 +1,112 @@
+"""Record selected voxels into a preallocated NumPy buffer at a fixed interval.
+
+One h.Vector().record(node._ref_concentration) per node stores every step of
+every voxel, and rebuilding node lists such as ca.nodes(mycell.apic[1]) at
+each checkpoint repeats the search each time. VoxelRecorder takes the node
+set once, caches where rxd stores each node's value, and fills
+a (num_samples, num_nodes) buffer every `interval` ms (or every `decimation`
+steps of fixed-step integration). Memory is bounded by the buffer size, which
+is allocated up front and may be a np.memmap for runs too long to keep in RAM.
+
+Sampling is driven by CVode.event rather than a per-step Python callback, so
+the cost is one vectorized gather per sample:
+
+    rec = VoxelRecorder(ca.nodes(mycell.apic[1]), interval=3 * ms, tstop=570 * ms,
+                        filename="apic1.npy")
+    h.finitialize(-65 * mV)
+    h.continuerun(570 * ms)
+    rec.data.max(axis=1)   # max over the nodes at each sample time
+"""
+import numpy as np
+from neuron import h
+from neuron.rxd import node as rxd_node
+from neuron.rxd.node import Node3D
+
+
+def _state_groups(nodes):
+    """group node positions by the state array that holds their values
+
+    Returns (get_array, positions, indices) triples: the values of nodes
+    [positions] are get_array()[indices]. 1D nodes live in rxd's global state
+    array and 3D nodes in their species' per-region array; both can be
+    reallocated by rxd, so the arrays are looked up again at each sample.
+    """
+    groups = {}
+    for position, node in enumerate(nodes):
+        try:
+            if isinstance(node, Node3D):
+                instance = node._speciesref()._intracellular_instances[node._r]
+                key = id(instance)
+                get_array = lambda instance=instance: instance.states
+            else:
+                key = "1d"
+                get_array = lambda: rxd_node._states
+        except (AttributeError, KeyError):
+            # unknown layout; read this node through its public value property
+            key = ("node", position)
+            get_array = lambda node=node: np.array([node.value])
+            index = 0
+        else:
+            index = node._index
+        group = groups.setdefault(key, (get_array, [], []))
+        group[1].append(position)
+        group[2].append(index)
+    return [
+        (get_array, np.array(positions), np.array(indices, dtype=np.int64))
+        for get_array, positions, indices in groups.values()
+    ]
+
+
+class VoxelRecorder:
+    def __init__(self, nodes, interval=None, decimation=None, tstop=None, num_samples=None, filename=None):
+        """nodes -- a node list (e.g. species.nodes(sec)); evaluated once, here
+        interval -- sampling interval (ms); or
+        decimation -- sample every decimation-th fixed step (interval = decimation * h.dt)
+        tstop or num_samples -- size of the buffer (num_samples = tstop / interval + 1)
+        filename -- if given, the buffer is a memory-mapped .npy file of float64
+        """
+        if (interval is None) == (decimation is None):
+            raise ValueError("specify exactly one of interval or decimation")
+        if interval is None:
+            interval = decimation * h.dt
+        if num_samples is None:
+            if tstop is None:
+                raise ValueError("specify tstop or num_samples")
+            num_samples = int(round(tstop / interval)) + 1
+        self.interval = interval
+        self.nodes = list(nodes)
+        self._groups = _state_groups(self.nodes)
+        shape = (num_samples, len(self.nodes))
+        if filename is None:
+            self._buffer = np.empty(shape)
+        else:
+            self._buffer = np.lib.format.open_memmap(filename, mode="w+", dtype=float, shape=shape)
+        self.t = np.empty(num_samples)
+        self.num_samples = 0
+        self._fih = h.FInitializeHandler(self._on_finitialize)
+
+    @property
+    def data(self):
+        """the samples recorded so far, one row per sample time (self.t)"""
+        return self._buffer[: self.num_samples]
+
+    def _on_finitialize(self):
+        self.num_samples = 0
+        self._t0 = h.t
+        h.CVode().event(h.t, self._sample)
+
+    def _sample(self):
+        row = self._buffer[self.num_samples]
+        for get_array, positions, indices in self._groups:
+            row[positions] = get_array()[indices]
+        self.t[self.num_samples] = h.t
+        self.num_samples += 1
+        # stop when the buffer is full rather than grow it; schedule from the
+        # start time so round-off does not accumulate
+        if self.num_samples < len(self._buffer):
+            h.CVode().event(self._t0 + self.num_samples * self.interval, self._sample)
+
+    def flush(self):
+        """write a memory-mapped buffer to disk"""
+        if isinstance(self._buffer, np.memmap):
+            self._buffer.flush()
@@ -0,0 +1,223 @@
+"""All studies' results in one indexed database, with columnar export.
+
+Each script keeps writing its own sqlite3 database. Warehouse.refresh() copies
+the tables of those that changed since the last refresh into results.db: one
+table per study with declared column types and indexes on the columns
+analyses filter by. Queries read only the rows and columns asked for:
+
+    warehouse = Warehouse()
+    warehouse.refresh()
+    data = warehouse.query("discretization", ["morphology", "dx", "volume"], dx=(0.1, 0.5))
+    data = warehouse.query("thread_scaling", kinetics="cawave", nthread=[1, 2, 4, 8])
+
+Predicates are a value (equality), a (low, high) pair (inclusive; None for an
+open end), or a list (membership). warehouse.sql() runs any statement, so
+analyses across studies are one query (see accuracy_vs_runtime).
+
+warehouse.export(directory) writes one Parquet file per study (requires
+pyarrow) and read_export() reads them back with the same predicates, pushed
+down to the Parquet reader.
+
+    python warehouse.py [refresh]         -- import new results and list the studies
+    python warehouse.py export DIRECTORY
+"""
+import os
+import sqlite3
+import sys
+import pandas as pd
+
+WAREHOUSE_FILENAME = "results.db"
+
+# study: (database, table, columns to index); a list of tables is combined
+# into one, with the table each row came from in a "model" column
+STUDIES = {
+    "discretization": ("discretization.db", "morphology", ["morphology", "dx"]),
+    "discretization_phases": ("discretization.db", "phases", ["morphology", "dx", "phase"]),
+    "thread_scaling": ("thread_scaling.db", "data", ["morphology", "kinetics", "dx", "nthread"]),
+    "wave_time_3d": ("wave_time_3d.db", "data", ["dx", "alpha"]),
+    "cylinder_convergence": ("cylinder_convergence.db", "data", ["dx"]),
+    "simple_geometry_convergence": ("simple_geometry_convergence.db", "data", ["dx", "resolution"]),
+    "conservation_tests": ("conservation_tests.db", ["line", "split_align", "split_y"], ["dx", "model"]),
+    "network_scaling": ("network_scaling.db", "data", ["num_cells", "nthread", "dx"]),
+    "reaction_cost": ("reaction_cost.db", "data", ["morphology", "dx", "variant"]),
+    "response_to_currents": ("response_to_currents.db", "data", ["dx"]),
+    "accurate_dt": ("accurate_dt.db", "data", ["model"]),
+    "synapse_array": ("synapse_array.db", "data", ["num_synapses", "method"]),
+}
+
+
+def sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def where_clause(predicates):
+    """SQL condition and parameters for keyword predicates (see the module docstring)"""
+    conditions = []
+    params = []
+    for column, value in predicates.items():
+        if isinstance(value, tuple):
+            low, high = value
+            if low is not None:
+                conditions.append(f'"{column}" >= ?')
+                params.append(low)
+            if high is not None:
+                conditions.append(f'"{column}" <= ?')
+                params.append(high)
+        elif isinstance(value, (list, set)):
+            value = list(value)
+            conditions.append(f'"{column}" IN ({", ".join("?" * len(value))})')
+            params.extend(value)
+        else:
+            conditions.append(f'"{column}" = ?')
+            params.append(value)
+    return " AND ".join(conditions) or "1", params
+
+
+class Warehouse:
+    def __init__(self, filename=WAREHOUSE_FILENAME, directory="."):
+        """directory -- where the per-study databases are"""
+        self.filename = filename
+        self.directory = directory
+        with sqlite3.connect(self.filename) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sources (study TEXT PRIMARY KEY, mtime REAL, num_rows INTEGER)")
+
+    def refresh(self):
+        """re-import the studies whose databases changed; returns their names"""
+        refreshed = []
+        with sqlite3.connect(self.filename) as conn:
+            imported = dict(conn.execute("SELECT study, mtime FROM sources"))
+            for study, (database, table, index_columns) in STUDIES.items():
+                path = os.path.join(self.directory, database)
+                if not os.path.exists(path):
+                    continue
+                mtime = os.path.getmtime(path)
+                if imported.get(study) == mtime:
+                    continue
+                data = self._read(path, table)
+                if data is None:
+                    continue
+                self._replace(conn, study, data, index_columns)
+                conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (study, mtime, len(data)))
+                conn.commit()
+                refreshed.append(study)
+        return refreshed
+
+    def _read(self, path, table):
+        tables = [table] if isinstance(table, str) else table
+        frames = []
+        with sqlite3.connect(path) as source:
+            for name in tables:
+                try:
+                    frame = pd.read_sql(f'SELECT * FROM "{name}"', source)
+                except pd.errors.DatabaseError as e:
+                    print(f"Warehouse: skipping table {name} of {path}: {e}")
+                    continue
+                if not isinstance(table, str):
+                    frame.insert(0, "model", name)
+                frames.append(frame)
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+    def _replace(self, conn, study, data, index_columns):
+        columns = ", ".join(f'"{column}" {sql_type(dtype)}' for column, dtype in data.dtypes.items())
+        conn.execute(f"DROP TABLE IF EXISTS {study}")
+        conn.execute(f"CREATE TABLE {study} ({columns})")
+        for column in index_columns:
+            if column in data:
+                conn.execute(f'CREATE INDEX {study}_{column} ON {study} ("{column}")')
+        conn.executemany(
+            f"INSERT INTO {study} VALUES ({', '.join('?' * len(data.columns))})",
+            data.astype(object).where(data.notna(), None).itertuples(index=False, name=None),
+        )
+
+    def studies(self):
+        """the imported studies and their row counts"""
+        with sqlite3.connect(self.filename) as conn:
+            return dict(conn.execute("SELECT study, num_rows FROM sources ORDER BY study"))
+
+    def columns(self, study):
+        with sqlite3.connect(self.filename) as conn:
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({study})")]
+        if not columns:
+            raise KeyError(f"no results for study {study!r}; run refresh()")
+        return columns
+
+    def query(self, study, columns=None, **predicates):
+        """rows of study matching the predicates, with only the given columns"""
+        known = self.columns(study)
+        unknown = set(columns or []) | set(predicates)
+        unknown -= set(known)
+        if unknown:
+            raise ValueError(f"{study} has no column(s) {sorted(unknown)}")
+        selected = ", ".join(f'"{column}"' for column in columns) if columns else "*"
+        condition, params = where_clause(predicates)
+        return self.sql(f"SELECT {selected} FROM {study} WHERE {condition}", params)
+
+    def sql(self, statement, params=()):
+        with sqlite3.connect(self.filename) as conn:
+            return pd.read_sql(statement, conn, params=params)
+
+    def export(self, directory, studies=None):
+        """write each study to directory/study.parquet"""
+        os.makedirs(directory, exist_ok=True)
+        for study in studies or self.studies():
+            self.query(study).to_parquet(os.path.join(directory, f"{study}.parquet"), index=False)
+
+
+def read_export(directory, study, columns=None, **predicates):
+    """read an exported study, reading only the needed columns and row groups"""
+    filters = []
+    for column, value in predicates.items():
+        if isinstance(value, tuple):
+            low, high = value
+            if low is not None:
+                filters.append((column, ">=", low))
+            if high is not None:
+                filters.append((column, "<=", high))
+        elif isinstance(value, (list, set)):
+            filters.append((column, "in", list(value)))
+        else:
+            filters.append((column, "==", value))
+    return pd.read_parquet(
+        os.path.join(directory, f"{study}.parquet"), columns=columns, filters=filters or None
+    )
+
+
+def accuracy_vs_runtime(warehouse, max_dx=None):
+    """relative error against run time for every study that measures both
+
+    The run time is the whole cost of one result: for wave_time_3d, the build
+    (stored separately since alphas share it; older rows include it in
+    sim_time) plus the run.
+    """
+    condition, params = where_clause({"dx": (None, max_dx)})
+    studies = warehouse.studies()
+    selects = []
+    if "simple_geometry_convergence" in studies:
+        selects.append(
+            f"""SELECT 'simple_geometry_convergence' AS study, dx, ABS(volume_relative_error) AS relative_error, runtime
+            FROM simple_geometry_convergence WHERE {condition}"""
+        )
+    if "wave_time_3d" in studies:
+        wave_runtime = "sim_time + COALESCE(build_time, 0)" if "build_time" in warehouse.columns("wave_time_3d") else "sim_time"
+        selects.append(
+            f"""SELECT 'wave_time_3d' AS study, dx, relative_error, {wave_runtime} AS runtime
+            FROM wave_time_3d WHERE {condition}"""
+        )
+    if not selects:
+        return pd.DataFrame({"study": [], "dx": [], "relative_error": [], "runtime": []})
+    return warehouse.sql(" UNION ALL ".join(selects), params * len(selects))
+
+if __name__ == "__main__":
+    warehouse = Warehouse()
+    if len(sys.argv) > 2 and sys.argv[1] == "export":
+        warehouse.refresh()
+        warehouse.export(sys.argv[2])
+    else:
+        refreshed = warehouse.refresh()
+        print(f"refreshed: {', '.join(refreshed) or 'nothing'}")
+        for study, num_rows in warehouse.studies().items():
+            print(f"    {study}: {num_rows} rows")
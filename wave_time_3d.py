@@ -1,26 +1,24 @@
 import multiprocessing
 import random
 import sqlite3
-import pandas as pd
+import sys
 from neuron import h, rxd
 from neuron.units import mV, ms
-
-h.load_file("stdrun.hoc")
+from profiling import MemoryTracker, add_missing_columns
+from stop_conditions import StopConditions
 
 THRESHOLD_CONCENTRATION = 0.5
 NUM_ORIENTATIONS = 100
+ALPHAS = [0.25, 0.15, 0.35]
 
+# (theta, phi, dx, alpha) already in the database; read without pandas to keep workers light
 try:
     with sqlite3.connect("wave_time_3d.db") as conn:
-        old_data = pd.read_sql("SELECT * FROM data", conn)
-except:
-    old_data = pd.DataFrame({"theta": [], "phi": [], "alpha": [], "dx": []})
-
-def on_stopevent():
-    h.stoprun = True
-
+        done = set(conn.execute("SELECT theta, phi, dx, alpha FROM data"))
+except sqlite3.OperationalError:
+    done = set()
 
-def save_data(theta, phi, dx, alpha, length, diam, speed, error, sim_time):
+def save_data(theta, phi, dx, alpha, length, diam, speed, error, build_time, sim_time, num_voxels, memory):
     # connect to the database (or create it if it doesn't exist)
     conn = sqlite3.connect("wave_time_3d.db")
     c = conn.cursor()
@@ -37,28 +35,49 @@ def save_data(theta, phi, dx, alpha, length, diam, speed, error, sim_time):
             diam REAL,
             speed REAL,
             relative_error REAL,
-            sim_time REAL
+            build_time REAL,
+            sim_time REAL,
+            num_voxels INTEGER,
+            baseline_rss INTEGER,
+            build_rss INTEGER,
+            build_peak_rss INTEGER,
+            run_peak_rss INTEGER,
+            build_bytes_per_voxel REAL,
+            run_bytes_per_voxel REAL
         )
         """
     )
+    add_missing_columns(conn, "data", ["build_time", "num_voxels"] + MemoryTracker.COLUMNS)
 
     # store the data
+    record = memory.record(num_voxels)
     c.execute(
-        "INSERT INTO data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (theta, phi, dx, alpha, length, diam, speed, error, sim_time),
+        f"""
+        INSERT INTO data (theta, phi, dx, alpha, length, diam, speed, relative_error, build_time, sim_time, num_voxels, {", ".join(record)})
+        VALUES ({", ".join("?" * (11 + len(record)))})
+        """,
+        (theta, phi, dx, alpha, length, diam, speed, error, build_time, sim_time, num_voxels, *record.values()),
     )
     conn.commit()
     conn.close()
 
 
 def run_sim(theta, phi, dx, alpha=0.25, L=251, diam=2):
+    run_sims(theta, phi, dx, [alpha], L=L, diam=diam)
+
+
+def run_sims(theta, phi, dx, alphas, L=251, diam=2):
     # theta, phi are polar angle and azimuthal angle, respectively
     # per ISO 80000-2:2019... this is physics style not math convention
     # theta \in [0, \pi), phi \in [0, 2*pi)
+    # the geometry is voxelized once; only the alpha parameter changes between runs
     import time
     import numpy as np
 
+    # loaded here rather than at import so queue workers start quickly
+    h.load_file("stdrun.hoc")
     start = time.perf_counter()
+    memory = MemoryTracker()
 
     # setup the model geometry
     dend = h.Section(name="dend")
@@ -76,7 +95,8 @@ def run_sim(theta, phi, dx, alpha=0.25, L=251, diam=2):
     c = rxd.Species(
         cyt, d=1, name="c", initial=lambda node: 1 if node.x * dend.L < 50 else 0
     )
-    wave_reaction = rxd.Rate(c, -c * (1 - c) * (alpha - c))
+    alpha_param = rxd.Parameter(cyt, name="alpha", value=alphas[0])
+    wave_reaction = rxd.Rate(c, -c * (1 - c) * (alpha_param - c))
 
     # integration options
     rxd.nthread(4)
@@ -88,48 +108,74 @@ def run_sim(theta, phi, dx, alpha=0.25, L=251, diam=2):
     distance = h.distance(pt1, pt2)
 
     # monitor concentration timecourses at the points above
-    threshold = h.ref(THRESHOLD_CONCENTRATION)
     c_pt1 = h.Vector().record(pt1._ref_ci)
     c_pt2 = h.Vector().record(pt2._ref_ci)
     t = h.Vector().record(h._ref_t)
 
     # stop simulation when pt2 crosses the threshold
-    ste = h.StateTransitionEvent(1)
-    ste.transition(0, 0, pt2._ref_ci, threshold, on_stopevent)
-
-    def on_finitialize():
-        ste.state(0)
-
-    fih = h.FInitializeHandler(on_finitialize)
+    stop = StopConditions()
+    stop.threshold(THRESHOLD_CONCENTRATION, ref=pt2._ref_ci)
 
     # use variable step integration
     h.CVode().active(True)
     h.CVode().atol(1e-6)
 
-    # actually run the simulation
+    # the first finitialize voxelizes the model; it is timed as part of the build
     h.finitialize(-65 * mV)
-    h.continuerun(3000 * ms)
-    print(f"end time: {h.t}")
-
-    # interpolate to estimate the crossing times
-    pt1_crossing_time = np.interp(THRESHOLD_CONCENTRATION, c_pt1, t)
-    pt2_crossing_time = np.interp(THRESHOLD_CONCENTRATION, c_pt2, t)
-
-    measured_speed = distance / (pt2_crossing_time - pt1_crossing_time)
-    expected_speed = 2 ** 0.5 * (0.5 - alpha)
-    speed_error = abs(1 - measured_speed / expected_speed)
-
-    print(f"pt1_crossing_time = {pt1_crossing_time}")
-    print(f"pt2_crossing_time = {pt2_crossing_time}")
-    print(f"speed = {measured_speed}")
-    print(f"expected speed = {expected_speed}")
-    print(f"relative error = {speed_error}")
-
-    finished = time.perf_counter()
-    print(f"elapsed time = {finished - start} s")
-    save_data(
-        theta, phi, dx, alpha, L, diam, measured_speed, speed_error, finished - start
-    )
+    memory.end_build()
+    build_time = time.perf_counter() - start
+    print(f"build time = {build_time} s")
+
+    for alpha in alphas:
+        print(f"alpha = {alpha}")
+        # the new value takes effect at the next finitialize
+        alpha_param.initial = alpha
+
+        # actually run the simulation
+        start = time.perf_counter()
+        h.finitialize(-65 * mV)
+        h.continuerun(3000 * ms)
+        memory.end_run()
+        print(f"end time: {h.t} ({stop.reason})")
+        print(f"peak RSS: build {memory.build_peak_rss} bytes, run {memory.run_peak_rss} bytes")
+
+        # interpolate to estimate the crossing times
+        pt1_crossing_time = np.interp(THRESHOLD_CONCENTRATION, c_pt1, t)
+        pt2_crossing_time = np.interp(THRESHOLD_CONCENTRATION, c_pt2, t)
+
+        measured_speed = distance / (pt2_crossing_time - pt1_crossing_time)
+        expected_speed = 2 ** 0.5 * (0.5 - alpha)
+        speed_error = abs(1 - measured_speed / expected_speed)
+
+        print(f"pt1_crossing_time = {pt1_crossing_time}")
+        print(f"pt2_crossing_time = {pt2_crossing_time}")
+        print(f"speed = {measured_speed}")
+        print(f"expected speed = {expected_speed}")
+        print(f"relative error = {speed_error}")
+
+        # every row of a build stores the same build_time; sim_time is this alpha's run alone
+        sim_time = time.perf_counter() - start
+        print(f"elapsed time = {sim_time} s")
+        save_data(
+            theta, phi, dx, alpha, L, diam, measured_speed, speed_error, build_time, sim_time,
+            len(c.nodes), memory
+        )
+
+
+def run_missing(theta, phi, dx):
+    """run_sims for the alphas not in the database when the job starts (for queue workers)"""
+    try:
+        with sqlite3.connect("wave_time_3d.db") as conn:
+            stored = {
+                alpha for (alpha,) in conn.execute(
+                    "SELECT alpha FROM data WHERE theta = ? AND phi = ? AND dx = ?", (theta, phi, dx)
+                )
+            }
+    except sqlite3.OperationalError:
+        stored = set()
+    alphas = [alpha for alpha in ALPHAS if alpha not in stored]
+    if alphas:
+        run_sims(theta, phi, dx, alphas)
 
 
 if __name__ == "__main__":
@@ -142,16 +188,42 @@ if __name__ == "__main__":
         for _ in range(NUM_ORIENTATIONS)
     ]
 
-    # do the parameter study
-    for dx in [2 ** -1, 2 ** -2, 2 ** -3, 2 ** -4, 1, 2 ** -5]:
-        for alpha in [0.25, 0.15, 0.35]:
-            for theta, phi in orientations:
-                if any((old_data["dx"] == dx) & (old_data["alpha"] == alpha) & (old_data["theta"] == theta) & (old_data["phi"] == phi)):
-                    print(f"Skipping: dx={dx}, alpha={alpha}, theta={theta}, phi={phi}")
-                else:
-                    print(f"Running: dx={dx}, alpha={alpha}, theta={theta}, phi={phi}")
-                    p = multiprocessing.Process(
-                        target=run_sim, args=(theta, phi, dx, alpha)
-                    )
-                    p.start()
-                    p.join()
+    dxs = [2 ** -1, 2 ** -2, 2 ** -3, 2 ** -4, 1, 2 ** -5]
+
+    def missing_alphas(theta, phi, dx):
+        alphas = []
+        for alpha in ALPHAS:
+            if (theta, phi, dx, alpha) in done:
+                print(f"Skipping: dx={dx}, alpha={alpha}, theta={theta}, phi={phi}")
+            else:
+                alphas.append(alpha)
+        return alphas
+
+    if len(sys.argv) > 1 and sys.argv[1] == "queue":
+        # python wave_time_3d.py queue [queue_file]
+        # run on as many machines as wanted; each claims (dx, orientation) jobs from the shared queue
+        from job_queue import JobQueue, QUEUE_FILENAME
+
+        queue = JobQueue(sys.argv[2] if len(sys.argv) > 2 else QUEUE_FILENAME, "wave_time_3d")
+        # jobs are keyed on the geometry alone, so workers started at any point
+        # add the same jobs; the alphas still missing are looked up when a job runs
+        queue.add([
+            {"theta": theta, "phi": phi, "dx": dx}
+            for dx in dxs
+            for theta, phi in orientations
+            if missing_alphas(theta, phi, dx)
+        ])
+        queue.run_worker(run_missing)
+        sys.exit()
+
+    # do the parameter study; each (dx, orientation) is voxelized once for all alphas
+    for dx in dxs:
+        for theta, phi in orientations:
+            alphas = missing_alphas(theta, phi, dx)
+            if alphas:
+                print(f"Running: dx={dx}, alphas={alphas}, theta={theta}, phi={phi}")
+                p = multiprocessing.Process(
+                    target=run_sims, args=(theta, phi, dx, alphas)
+                )
+                p.start()
+                p.join()